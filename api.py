@@ -1,49 +1,70 @@
+from array import array
 from datetime import datetime, timedelta
-from random import random, shuffle, randint
-from math import ceil
-import copy
+from multiprocessing import Pool
+import random
+from collections import defaultdict
 from operator import itemgetter
 
 from utils import (
     load_json_from_file,
     year_diff,
     increment_year,
-    parse_iso_datetime,
     random_item_from_iterable,
-    random_key,
     random_n_up_to_limit,
     split_list_by_percent,
     get_random_range_from_iterable,
-    chunk_list,
+    split_list_evenly,
+    split_list_by_sizes,
+    balanced_part_sizes,
+    chunk_iterable,
+    derive_rng,
 )
-from randomuser_client import parse_randomuser_data
+from randomuser_client import (
+    parse_randomuser_data,
+    count_worker_state_lookup_misses,
+    add_worker_state_lookup_misses,
+)
+from date_tables import UserDateTable
+from records import EducationRecord, EmploymentRecord
+import settings
 from settings import (
     PAST_COURSE_RUNS_TO_CREATE,
     COURSE_RUN_MONTH_RANGES,
     COURSE_DAY,
     ENROLLMENT_DELTA,
     UPGRADE_DELTA,
-    FIELDS_OF_STUDY,
+    INDUSTRY_SAMPLER,
+    COMPANY_SAMPLERS,
     DEGREES,
     EMPLOYMENT,
     EMPLOYMENT_YEAR_LENGTH,
-    COUNTRY_STATE_CODE_MAP,
-    COPY_TO_FIELDS,
-    PCT_USERS_ENROLLED
+    PCT_USERS_MOVED,
+    PCT_USERS_ENROLLED,
+    GRADE_RANGE,
+    CROSS_PROGRAM_EDX_COHORTS,
+    PROGRAM_EDX_COHORTS,
+    USER_SHARD_SIZE,
 )
 from path import BASE_PROGRAM_DATA_PATH
 
 NOW = datetime.now()
+# Every possible grade, formatted as it appears in the output
+GRADE_VALUES = tuple('{0:.2f}'.format(grade / 100) for grade in range(GRADE_RANGE[0], GRADE_RANGE[1] + 1))
 
 
 def generate_edx_key(course_title, course_start_date):
-    return 'course-v1:MITx+{}+{}'.format(course_title.replace(' ', '+'), course_start_date.strftime('%b_%Y'))
+    return edx_key_from_suffix(course_title, course_start_date.strftime('%b_%Y'))
+
 
+def edx_key_from_suffix(course_title, edx_key_suffix):
+    return 'course-v1:MITx+{}+{}'.format(course_title.replace(' ', '+'), edx_key_suffix)
 
-def create_course_run(course_data, start_date, end_date):
+
+def create_course_run_calendar_entry(start_date, end_date):
+    """Formatted values of a course run that only depend on its dates, shared by every course with a run then"""
     return {
-        'title': '{} - {}'.format(course_data['title'], start_date.strftime('%B %Y')),
-        'edx_course_key': generate_edx_key(course_data['title'], start_date),
+        'title_suffix': start_date.strftime('%B %Y'),
+        'edx_key_suffix': start_date.strftime('%b_%Y'),
         'start_date': start_date.isoformat(),
         'end_date': end_date.isoformat(),
         'enrollment_start': start_date.isoformat(),
@@ -52,209 +73,349 @@ def create_course_run(course_data, start_date, end_date):
     }
 
 
-def create_past_course_runs(course_data):
-    course_runs = []
+def build_course_run_calendar(run_count=PAST_COURSE_RUNS_TO_CREATE, now=NOW):
+    """
+    Creates calendar entries for the latest run_count past course runs, latest first. Every course has runs
+    on the same dates, so the calendar is built once and shared by all of them.
+    """
+    calendar = []
     index = 0
     # Reverse sort month ranges so the script will try to create later months first
     month_ranges = sorted(list(COURSE_RUN_MONTH_RANGES), key=itemgetter(0), reverse=True)
 
-    while len(course_runs) < PAST_COURSE_RUNS_TO_CREATE:
-        year = NOW.year - index
+    while len(calendar) < run_count:
+        year = now.year - index
         for month_range in month_ranges:
             start_date = datetime(year=year, month=month_range[0], day=COURSE_DAY)
             end_date = datetime(year=year, month=month_range[1], day=COURSE_DAY)
-            if end_date < NOW and len(course_runs) < PAST_COURSE_RUNS_TO_CREATE:
-                course_runs.append(create_course_run(course_data, start_date, end_date))
+            if end_date < now and len(calendar) < run_count:
+                calendar.append(create_course_run_calendar_entry(start_date, end_date))
         index += 1
-    return course_runs
-
+    return calendar
 
-### Profile data generation functions
 
-def create_education_record(user, dob, degree_info):
-    education_record = {
-        'degree_name': degree_info['name'],
-        'graduation_date': increment_year(dob, degree_info['grad_age']).date().isoformat(),
-        'school_name': u'{} {}'.format(user['city'], degree_info['school_suffix']),
-        'school_city': user['city'],
-        'school_state_or_territory': user['state_or_territory'],
-        'school_country': user['country'],
+def create_course_run(course_data, calendar_entry):
+    return {
+        'title': '{} - {}'.format(course_data['title'], calendar_entry['title_suffix']),
+        'edx_course_key': edx_key_from_suffix(course_data['title'], calendar_entry['edx_key_suffix']),
+        'start_date': calendar_entry['start_date'],
+        'end_date': calendar_entry['end_date'],
+        'enrollment_start': calendar_entry['enrollment_start'],
+        'enrollment_end': calendar_entry['enrollment_end'],
+        'upgrade_deadline': calendar_entry['upgrade_deadline'],
     }
-    if degree_info['name'] != 'High school':
-        education_record['field_of_study'] = random_key(FIELDS_OF_STUDY)
-    return education_record
 
 
-def create_education_records(user):
+def create_past_course_runs(course_data, calendar=None):
+    if calendar is None:
+        calendar = build_course_run_calendar()
+    return [create_course_run(course_data, calendar_entry) for calendar_entry in calendar]
+
+
+### Profile data generation functions
+
+def create_education_record(user, dob, degree_info, rng=random, graduation_date=None):
+    field_of_study = None
+    if degree_info['name'] != 'High school':
+        field_of_study = settings.FIELD_OF_STUDY_SAMPLER.draw(rng)
+    return EducationRecord(
+        degree_name=degree_info['name'],
+        graduation_date=graduation_date or increment_year(dob, degree_info['grad_age']),
+        school_name=u'{} {}'.format(user.city, degree_info['school_suffix']),
+        school_city=user.city,
+        school_state_or_territory=user.state_or_territory,
+        school_country=user.country,
+        field_of_study=field_of_study,
+    )
+
+
+def create_education_records(user, rng=random, date_table=None):
+    if date_table is not None:
+        return [
+            create_education_record(user, None, degree_info, rng=rng, graduation_date=graduation_date)
+            for degree_info, graduation_date in date_table.degrees_earned(user.date_of_birth)
+        ]
     education_records = []
-    dob = parse_iso_datetime(user['date_of_birth'])
+    dob = user.date_of_birth
     years_old = year_diff(dob, NOW)
     for degree_info in DEGREES.values():
         if years_old >= degree_info['grad_age']:
-            education_records.append(create_education_record(user, dob, degree_info))
+            education_records.append(create_education_record(user, dob, degree_info, rng=rng))
     return education_records
 
 
-def create_employment_record(user):
-    employment_industry = random_key(EMPLOYMENT)
-    return {
-        'city': user['city'],
-        'country': user['country'],
-        'state_or_territory': user['state_or_territory'],
-        'industry': employment_industry,
-        'company_name': random_item_from_iterable(EMPLOYMENT[employment_industry]['company_name']),
-    }
+def create_employment_record(user, rng=random):
+    employment_industry = INDUSTRY_SAMPLER.draw(rng)
+    return EmploymentRecord(
+        city=user.city,
+        country=user.country,
+        state_or_territory=user.state_or_territory,
+        industry=employment_industry,
+        company_name=COMPANY_SAMPLERS[employment_industry].draw(rng),
+    )
 
 
-def create_employment_records(user):
+def create_employment_records(user, rng=random, date_table=None):
     employment_records = []
-    base_employment_record = create_employment_record(user)
-    rand = random()
+    base_employment_record = create_employment_record(user, rng=rng)
+    rand = rng.random()
     employment_count = 1 if rand <= 0.5 else 2
     for i in range(employment_count):
-        employment_record = copy.copy(base_employment_record)
-        employment_industry = employment_record['industry']
-        employment_record['position'] = EMPLOYMENT[employment_industry]['position'][i]
+        employment_record = base_employment_record.copy()
+        employment_record.position = EMPLOYMENT[employment_record.industry]['position'][i]
         # Set employment date ranges to be X years long; if this is the first record,
         #   don't set an end date (which will make it a current employment)
-        employment_record['start_date'] = increment_year(NOW, -EMPLOYMENT_YEAR_LENGTH * (i + 1)).date().isoformat()
+        if date_table is not None:
+            (start_date, end_date) = date_table.employment_dates[i]
+        else:
+            start_date = increment_year(NOW, -EMPLOYMENT_YEAR_LENGTH * (i + 1)).date()
+            end_date = increment_year(NOW, -EMPLOYMENT_YEAR_LENGTH * i).date()
+        employment_record.start_date = start_date
         if i > 0:
-            employment_record['end_date'] = increment_year(NOW, -EMPLOYMENT_YEAR_LENGTH * i).date().isoformat()
+            employment_record.end_date = end_date
         employment_records.append(employment_record)
     return employment_records
 
 
-def create_user_from_result(user):
-    user = parse_randomuser_data(user, NOW)
-    for copy_tuple in COPY_TO_FIELDS:
-        user[copy_tuple[1]] = user[copy_tuple[0]]
-    user['education'] = create_education_records(user)
-    user['work_history'] = create_employment_records(user)
+def create_user_from_result(user, rng=random, date_table=None):
+    user = parse_randomuser_data(user, NOW, rng=rng, date_table=date_table)
+    user.education = create_education_records(user, rng=rng, date_table=date_table)
+    user.work_history = create_employment_records(user, rng=rng, date_table=date_table)
     return user
 
 
-### Enrollment/grade generation functions
+def create_user_batch(user_results, rng=random, date_table=None):
+    """
+    Creates users from a batch of raw results. Date values are computed for the whole batch at once and
+    looked up per user, and the output is identical to calling create_user_from_result on each result.
+    """
+    date_table = date_table or UserDateTable(NOW)
+    date_table.add_randomuser_dobs(user_result['dob'] for user_result in user_results)
+    return [create_user_from_result(user_result, rng=rng, date_table=date_table) for user_result in user_results]
 
-def create_enrollment(course_data, course_run_index):
-    course_run = course_data['course_runs'][course_run_index]
-    return {
-        "edx_course_key": course_run['edx_course_key']
-    }
 
+def create_user_shard(shard):
+    """Creates users from a shard of raw results using a random stream derived from the shard index"""
+    (seed, shard_index, user_results) = shard
+    return create_user_batch(user_results, rng=derive_rng(seed, 'users', shard_index))
 
-def create_grade(course_data, course_run_index, grade_range=(60, 100)):
-    course_run = course_data['course_runs'][course_run_index]
-    return {
-        "edx_course_key": course_run['edx_course_key'],
-        "grade": "{0:.2f}".format(randint(*grade_range) / 100)
-    }
 
+def create_worker_user_shard(shard):
+    """Creates users from a shard of raw results in a pool worker (see count_worker_state_lookup_misses)"""
+    return count_worker_state_lookup_misses(lambda: create_user_shard(shard))
 
-def create_edx_data_set(courses_data, num_enrollments=0, num_grades=None):
-    course_indices = range(0, num_enrollments)
-    num_grades = num_grades or num_enrollments
-    return {
-        '_enrollments': [
-            create_enrollment(course_data, course_indices[i])
-            for i, course_data in enumerate(courses_data[0:num_enrollments])
-        ],
-        '_grades': [
-            create_grade(course_data, course_indices[i])
-            for i, course_data in enumerate(courses_data[0:num_grades])
+
+def create_users_from_results(user_results, seed=None, workers=1):
+    """
+    Creates users from raw results. If a seed is given, results are split into fixed-size shards that each
+    get their own random stream, so the output for a seed is the same no matter how many workers are used.
+    """
+    if seed is None and workers <= 1:
+        date_table = UserDateTable(NOW)
+        return [
+            user
+            for batch in chunk_iterable(user_results, USER_SHARD_SIZE)
+            for user in create_user_batch(batch, date_table=date_table)
         ]
-    }
+    if seed is None:
+        seed = '{:016x}'.format(random.getrandbits(64))
+    shards = (
+        (seed, shard_index, shard_results)
+        for shard_index, shard_results in enumerate(chunk_iterable(user_results, USER_SHARD_SIZE))
+    )
+    if workers <= 1:
+        user_shards = map(create_user_shard, shards)
+        return [user for user_shard in user_shards for user in user_shard]
+    with Pool(workers) as pool:
+        # imap returns shards in order, regardless of which worker finishes first
+        user_shards = add_worker_state_lookup_misses(pool.imap(create_worker_user_shard, shards))
+        return [user for user_shard in user_shards for user in user_shard]
 
 
-def create_n_enrollments_with_grades(all_program_data, num_courses_to_enroll=1):
-    program_data = random_item_from_iterable(all_program_data)
-    return create_edx_data_set(program_data['courses'], num_enrollments=num_courses_to_enroll)
+### Enrollment/grade generation functions
+
+class ProgramEdxTemplates:
+    """
+    Course keys and enrollments for a program. Every user enrolled in the first n courses of a program
+    shares the same enrollment objects, since those only depend on the program and course run.
+    """
+    def __init__(self, program_data):
+        # As with past course runs, a user's enrollment in the program's nth course is in its nth run
+        self.course_keys = tuple(
+            course_data['course_runs'][min(i, len(course_data['course_runs']) - 1)]['edx_course_key']
+            for i, course_data in enumerate(program_data['courses'])
+        )
+        self.enrollments = tuple({'edx_course_key': course_key} for course_key in self.course_keys)
+
+
+def allocate_cohorts(user_indices, cohorts):
+    """
+    Splits user indices into one slice per cohort, sized by each cohort's 'pct' of all the indices.
+    A cohort with a 'pct' of None gets all of the indices that remain.
+    """
+    user_count = len(user_indices)
+    cohort_indices = []
+    for cohort in cohorts:
+        if cohort['pct'] is None:
+            (chosen_indices, user_indices) = (user_indices, [])
+        else:
+            (chosen_indices, user_indices) = split_list_by_percent(user_indices, cohort['pct'], user_count)
+        cohort_indices.append(chosen_indices)
+    return cohort_indices
+
+
+def assign_edx_cohort(all_user_data, user_indices, enrollments, graded_course_keys, rng=random):
+    """Gives every user in a cohort the same shared enrollments, and grades drawn for the whole cohort at once"""
+    grade_count = len(graded_course_keys)
+    grades = rng.choices(GRADE_VALUES, k=len(user_indices) * grade_count)
+    for position, i in enumerate(user_indices):
+        user = all_user_data[i]
+        user.enrollments = enrollments
+        user.grades = list(zip(graded_course_keys, grades[position * grade_count:(position + 1) * grade_count]))
 
 
 ### Program and user JSON file generation functions
 
 def build_full_program_data():
     program_data = load_json_from_file(BASE_PROGRAM_DATA_PATH)
+    calendar = build_course_run_calendar()
     for program_index in range(len(program_data)):
         for course_data in program_data[program_index]['courses']:
-            course_data['course_runs'] = create_past_course_runs(course_data)
+            course_data['course_runs'] = create_past_course_runs(course_data, calendar=calendar)
     return program_data
 
 
-def edit_full_user_data(all_user_data):
+def build_country_location_index(all_user_data, location_index=None):
     """
-    Makes changes to user data after API results are parsed and the user data is in the correct format
+    Groups the (country, state_or_territory, city) location of every user by country. If an existing
+    index is given, the locations are added to it.
     """
-    user_count = len(all_user_data)
+    if location_index is None:
+        location_index = defaultdict(list)
+    for user_data in all_user_data:
+        location_index[user_data.country].append(
+            (user_data.country, user_data.state_or_territory, user_data.city)
+        )
+    return location_index
+
 
-    # Change set of users to have a nationality different from their current country
-    group_indices = random_n_up_to_limit(int(user_count * 0.1), user_count)
+def plan_nationality_swaps(user_count, user_country, location_index, rng=random):
+    """
+    Picks a set of users to have a nationality different from their current country, yielding
+    (user index, new location) for each one. user_country(i) is the country of the user at index i, and new
+    locations are drawn from location_index (see build_country_location_index). Users in the only country with
+    locations are left as they are.
+    """
+    other_countries = {
+        country: [k for k in settings.COUNTRY_STATE_CODE_MAP.keys() if k != country and k in location_index]
+        for country in location_index
+    }
+    group_indices = random_n_up_to_limit(int(user_count * PCT_USERS_MOVED), user_count, rng=rng)
     for i in group_indices:
+        countries = other_countries[user_country(i)]
+        if not countries:
+            continue
+        new_country = random_item_from_iterable(countries, rng=rng)
+        yield i, random_item_from_iterable(location_index[new_country], rng=rng)
+
+
+def edit_full_user_data(all_user_data, rng=random, location_index=None):
+    """
+    Makes changes to user data after API results are parsed and the user data is in the correct format.
+    If a location index of previously generated users is given (see build_country_location_index), their
+    locations can also be drawn when users are moved to a new country.
+    """
+    # Index user locations by country once so each nationality swap is a constant-time draw
+    location_index = build_country_location_index(all_user_data, location_index=location_index)
+    swaps = plan_nationality_swaps(
+        len(all_user_data), lambda i: all_user_data[i].country, location_index, rng=rng
+    )
+    for i, location in swaps:
         user_data = all_user_data[i]
-        country = user_data['country']
-        new_country = random_item_from_iterable([
-            k for k in COUNTRY_STATE_CODE_MAP.keys() if k != country
-        ])
-        user_from_new_country = random_item_from_iterable([
-            data for data in all_user_data if
-            data['country'] == new_country
-        ])
-        user_data.update({
-            'country': user_from_new_country['country'],
-            'state_or_territory': user_from_new_country['state_or_territory'],
-            'city': user_from_new_country['city']
-        })
-        all_user_data[i] = user_data
+        (user_data.country, user_data.state_or_territory, user_data.city) = location
 
     return all_user_data
 
 
-def fill_in_edx_data(all_user_data, all_program_data):
-    user_count = len(all_user_data)
-    program_count = len(all_program_data)
-    user_list_indices = list(range(0, user_count))
-    shuffle(user_list_indices)
+def cross_program_cohort_courses(selected_templates, cohort):
+    """Gets the enrollments and graded course keys of a cross-program cohort in a range of adjacent programs"""
+    enrollments = tuple(
+        enrollment
+        for templates in selected_templates
+        for enrollment in templates.enrollments[:cohort['enrollments']]
+    )
+    graded_course_keys = tuple(
+        course_key
+        for templates in selected_templates
+        for course_key in templates.course_keys[:cohort['grades']]
+    )
+    return enrollments, graded_course_keys
+
+
+def iter_edx_cohorts(user_count, all_program_data, rng=random, cross_program_cohorts=CROSS_PROGRAM_EDX_COHORTS,
+                     program_cohorts=PROGRAM_EDX_COHORTS, program_user_counts=None):
+    """
+    Splits enrolled users into cohorts according to cohort distributions (see CROSS_PROGRAM_EDX_COHORTS and
+    PROGRAM_EDX_COHORTS in settings), yielding (user indices, enrollments, graded course keys) for each one.
+    The same rng is used to draw each cohort's grades, so they have to be drawn before the next cohort is
+    requested. If the number of users already enrolled in each program is given, users are split among
+    programs so the totals even out. Without any programs, no users are enrolled.
+    """
+    program_templates = [ProgramEdxTemplates(program_data) for program_data in all_program_data]
+    if not program_templates:
+        return
+    # Indices are kept in a compact array since this is the only per-user data that's needed
+    user_list_indices = array('I', range(0, user_count))
+    rng.shuffle(user_list_indices)
 
     (enrolled_indices, user_list_indices) = split_list_by_percent(user_list_indices, PCT_USERS_ENROLLED)
     enrolled_user_count = len(enrolled_indices)
 
-    # Create users with 2 courses across 2 programs, enrollment/grade in each
-    (chosen_indices, enrolled_indices) = split_list_by_percent(enrolled_indices, 0.2, enrolled_user_count)
-    program_index_range = get_random_range_from_iterable(all_program_data, 2)
-    selected_program_data = [all_program_data[i] for i in range(*program_index_range)]
-    for i in chosen_indices:
-        user_edx_data = {'_enrollments': [], '_grades': []}
-        for program_data in selected_program_data:
-            new_edx_data = create_edx_data_set(program_data['courses'], num_enrollments=1)
-            user_edx_data['_enrollments'] += new_edx_data['_enrollments']
-            user_edx_data['_grades'] += new_edx_data['_grades']
-        all_user_data[i].update(user_edx_data)
-
-    # Split remaining users into evenly-sized chunks. Each chunk will be given enrollments/grades
-    # in the available programs.
-    remaining_user_count = len(enrolled_indices)
-    program_user_chunk_size = ceil(remaining_user_count / program_count)
-    program_user_index_chunks = list(chunk_list(enrolled_indices, program_user_chunk_size))
-    for program_index, program_data in enumerate(all_program_data):
-        program_user_indices = program_user_index_chunks[program_index]
-        program_user_count = len(program_user_indices)
-
-        # Create users w/ 1 courses & enrollment/grade
-        (chosen_indices, program_user_indices) = split_list_by_percent(program_user_indices, 0.3, program_user_count)
-        for i in chosen_indices:
-            all_user_data[i].update(create_edx_data_set(program_data['courses'], num_enrollments=1))
-
-        # Create users w/ 2 courses, enrollment/grade in each
-        (chosen_indices, program_user_indices) = split_list_by_percent(program_user_indices, 0.5, program_user_count)
-        for i in chosen_indices:
-            all_user_data[i].update(create_edx_data_set(program_data['courses'], num_enrollments=2))
-
-        # Create users w/ 3 courses, enrollment/grade in each
-        (chosen_indices, program_user_indices) = split_list_by_percent(program_user_indices, 0.1, program_user_count)
-        for i in chosen_indices:
-            all_user_data[i].update(create_edx_data_set(program_data['courses'], num_enrollments=3))
-
-        # Create users w/ 2 courses, enrollment in each, grade in one
-        for i in program_user_indices:
-            all_user_data[i].update(create_edx_data_set(program_data['courses'], num_enrollments=2, num_grades=1))
+    # Give users enrollments/grades in a range of adjacent programs
+    for cohort in cross_program_cohorts:
+        (chosen_indices, enrolled_indices) = split_list_by_percent(enrolled_indices, cohort['pct'], enrolled_user_count)
+        program_index_range = get_random_range_from_iterable(
+            program_templates, min(cohort['programs'], len(program_templates)), rng=rng
+        )
+        (enrollments, graded_course_keys) = cross_program_cohort_courses(
+            program_templates[slice(*program_index_range)], cohort
+        )
+        yield chosen_indices, enrollments, graded_course_keys
+
+    # Split remaining users into evenly-sized groups. Each group will be given enrollments/grades
+    # in one of the available programs.
+    if program_user_counts is None:
+        program_user_index_groups = split_list_evenly(enrolled_indices, len(program_templates))
+    else:
+        program_user_index_groups = split_list_by_sizes(
+            enrolled_indices, balanced_part_sizes(program_user_counts, len(enrolled_indices))
+        )
+    for templates, program_user_indices in zip(program_templates, program_user_index_groups):
+        cohort_index_groups = allocate_cohorts(program_user_indices, program_cohorts)
+        for cohort, cohort_indices in zip(program_cohorts, cohort_index_groups):
+            yield (
+                cohort_indices,
+                templates.enrollments[:cohort['enrollments']],
+                templates.course_keys[:cohort['grades']],
+            )
+
+
+def fill_in_edx_data(all_user_data, all_program_data, rng=random, cross_program_cohorts=CROSS_PROGRAM_EDX_COHORTS,
+                     program_cohorts=PROGRAM_EDX_COHORTS, program_user_counts=None):
+    """
+    Assigns enrollments and grades to enrolled users according to cohort distributions
+    (see CROSS_PROGRAM_EDX_COHORTS and PROGRAM_EDX_COHORTS in settings). If the number of users already
+    enrolled in each program is given, users are split among programs so the totals even out.
+    """
+    cohorts = iter_edx_cohorts(
+        len(all_user_data),
+        all_program_data,
+        rng=rng,
+        cross_program_cohorts=cross_program_cohorts,
+        program_cohorts=program_cohorts,
+        program_user_counts=program_user_counts,
+    )
+    for user_indices, enrollments, graded_course_keys in cohorts:
+        assign_edx_cohort(all_user_data, user_indices, enrollments, graded_course_keys, rng=rng)
 
     return all_user_data
@@ -0,0 +1,43 @@
+import os
+import json
+import gzip
+import hashlib
+import tempfile
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+from path import API_CACHE_DIR
+
+
+def normalize_api_url(api_url):
+    """Sorts the querystring params of a URL so equivalent requests share a cache key"""
+    split_url = urlsplit(api_url)
+    params = sorted(parse_qsl(split_url.query, keep_blank_values=True))
+    return '{}://{}{}?{}'.format(split_url.scheme, split_url.netloc, split_url.path, urlencode(params))
+
+
+def api_cache_path(api_url, cache_dir=API_CACHE_DIR):
+    """Gets the path of the cached response for a URL, addressed by the hash of its normalized form"""
+    key = hashlib.sha256(normalize_api_url(api_url).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, key[:2], '{}.json.gz'.format(key))
+
+
+def load_cached_response(api_url, cache_dir=API_CACHE_DIR):
+    path = api_cache_path(api_url, cache_dir=cache_dir)
+    if not os.path.isfile(path):
+        return None
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_cached_response(api_url, resp_json, cache_dir=API_CACHE_DIR):
+    path = api_cache_path(api_url, cache_dir=cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temp file and move it into place so an interrupted run never leaves a partial entry
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with gzip.open(os.fdopen(fd, 'wb'), 'wt', encoding='utf-8') as f:
+            json.dump(resp_json, f, separators=(',', ':'))
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
@@ -0,0 +1,258 @@
+import os
+import sys
+import json
+import math
+import random
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+from time import perf_counter
+
+from utils import (
+    create_dir_if_none_exists,
+    write_json_to_file,
+    write_json_array_to_file,
+    write_json_lines_to_file,
+)
+from randomuser_client import (
+    create_param_groups,
+    parse_randomuser_data,
+)
+from localuser_client import local_user_iter
+from api import (
+    NOW,
+    build_full_program_data,
+    create_users_from_results,
+    edit_full_user_data,
+    fill_in_edx_data,
+)
+from records import serialize_users
+from dedupe import dedupe_user_emails
+from path import BENCHMARK_RESULTS_PATH, RESULT_DIR
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+STAGES = [
+    'parse_randomuser_data',
+    'create_user_from_result',
+    'dedupe_user_emails',
+    'edit_full_user_data',
+    'build_full_program_data',
+    'fill_in_edx_data',
+    'write_json',
+    'write_json_lines',
+]
+# Stages that don't depend on the number of users, so they aren't checked for superlinear scaling
+FIXED_SIZE_STAGES = {'build_full_program_data'}
+# A stage is flagged if time grows faster than (size ratio) ** SUPERLINEAR_EXPONENT between two sizes in
+# every timed run
+SUPERLINEAR_EXPONENT = 1.2
+# Times below this are too noisy to tell how a stage scales, so sizes where a stage is faster aren't compared
+MIN_SCALING_SECONDS = 0.1
+DEFAULT_REPEAT = 3
+# Maximum time to import each entry point module in a fresh interpreter (not counting interpreter startup)
+IMPORT_TIME_BUDGET_SECONDS = {
+    'api': 0.1,
+    'generate': 0.15,
+}
+# Modules that should only be imported by the code paths that need them
+DEFERRED_MODULES = ['requests', 'dateutil', 'pyarrow', 'numpy', 'cProfile']
+IMPORT_TIME_RUNS = 5
+IMPORT_TIME_SCRIPT = '''
+import sys, json, time
+start_time = time.perf_counter()
+import {module_name}
+seconds = time.perf_counter() - start_time
+deferred_modules = [name for name in {deferred_modules!r} if name in sys.modules]
+print(json.dumps({{'seconds': seconds, 'deferred_modules': deferred_modules}}))
+'''
+
+
+def create_synthetic_results(size, seed):
+    """Creates randomuser.me-shaped raw results locally so the benchmark doesn't touch the network"""
+    user_count_per_group = math.ceil(size / len(create_param_groups()))
+    return list(local_user_iter(user_count_per_group, seed))[:size]
+
+
+class StageTimer:
+    """Records the time (and optionally the peak traced memory) of each stage in a run"""
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stage_results = {}
+
+    def run(self, stage_name, func, *args, **kwargs):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+        start_time = perf_counter()
+        result = func(*args, **kwargs)
+        stage_result = {'seconds': perf_counter() - start_time}
+        if self.trace_memory:
+            stage_result['peak_bytes'] = tracemalloc.get_traced_memory()[1] - start_memory
+        self.stage_results[stage_name] = stage_result
+        return result
+
+
+def run_stages(raw_results, seed, output_dir, trace_memory=False):
+    timer = StageTimer(trace_memory=trace_memory)
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        random.seed(seed)
+        timer.run('parse_randomuser_data', lambda: [parse_randomuser_data(result, NOW) for result in raw_results])
+        users = timer.run('create_user_from_result', create_users_from_results, raw_results, seed=seed)
+        timer.run('dedupe_user_emails', dedupe_user_emails, users)
+        users = timer.run('edit_full_user_data', edit_full_user_data, users, rng=random.Random(seed))
+        program_data = timer.run('build_full_program_data', build_full_program_data)
+        users = timer.run('fill_in_edx_data', fill_in_edx_data, users, program_data, rng=random.Random(seed))
+        timer.run(
+            'write_json',
+            write_json_array_to_file, serialize_users(users), os.path.join(output_dir, 'users.json')
+        )
+        timer.run(
+            'write_json_lines',
+            write_json_lines_to_file, serialize_users(users), os.path.join(output_dir, 'users.jsonl')
+        )
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return timer.stage_results
+
+
+def find_superlinear_stages(stage_results_by_size):
+    """
+    Finds stages whose time grows faster than linearly between two consecutive sizes where the stage takes at
+    least MIN_SCALING_SECONDS, in every timed run. The smallest exponent across runs is reported.
+    """
+    flagged = []
+    for stage_name in STAGES:
+        if stage_name in FIXED_SIZE_STAGES:
+            continue
+        sizes = [
+            size for size in sorted(stage_results_by_size.keys())
+            if min(stage_results_by_size[size][stage_name]['run_seconds']) >= MIN_SCALING_SECONDS
+        ]
+        for smaller, larger in zip(sizes, sizes[1:]):
+            run_seconds = zip(
+                stage_results_by_size[smaller][stage_name]['run_seconds'],
+                stage_results_by_size[larger][stage_name]['run_seconds'],
+            )
+            exponent = min(
+                math.log(large_seconds / small_seconds) / math.log(larger / smaller)
+                for small_seconds, large_seconds in run_seconds
+            )
+            if exponent > SUPERLINEAR_EXPONENT:
+                flagged.append({
+                    'stage': stage_name,
+                    'from_size': smaller,
+                    'to_size': larger,
+                    'exponent': round(exponent, 3),
+                })
+    return flagged
+
+
+def measure_import_time(module_name, runs=IMPORT_TIME_RUNS):
+    """
+    Imports a module in fresh interpreters and returns the fastest import time, along with any modules
+    that should have been deferred but were imported anyway
+    """
+    script = IMPORT_TIME_SCRIPT.format(module_name=module_name, deferred_modules=DEFERRED_MODULES)
+    import_results = [
+        json.loads(subprocess.run(
+            [sys.executable, '-c', script],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True,
+            stdout=subprocess.PIPE,
+        ).stdout)
+        for _ in range(runs)
+    ]
+    return {
+        'seconds': min(import_result['seconds'] for import_result in import_results),
+        'budget_seconds': IMPORT_TIME_BUDGET_SECONDS[module_name],
+        'deferred_modules': import_results[0]['deferred_modules'],
+    }
+
+
+def find_import_budget_violations(import_times):
+    return [
+        module_name for module_name, import_time in import_times.items()
+        if import_time['seconds'] > import_time['budget_seconds'] or import_time['deferred_modules']
+    ]
+
+
+def run_benchmarks(sizes, seed, trace_memory=True, repeat=DEFAULT_REPEAT):
+    import_times = {module_name: measure_import_time(module_name) for module_name in IMPORT_TIME_BUDGET_SECONDS}
+    print('Import times: {}'.format(', '.join(
+        '{} {:.3f}s'.format(module_name, import_time['seconds']) for module_name, import_time in import_times.items()
+    )))
+    stage_results_by_size = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        for size in sizes:
+            raw_results = create_synthetic_results(size, seed)
+            # Keep the time of each stage in every run, and report the fastest one to reduce noise
+            stage_results = run_stages(raw_results, seed, output_dir)
+            for stage_result in stage_results.values():
+                stage_result['run_seconds'] = [stage_result['seconds']]
+            for _ in range(repeat - 1):
+                for stage_name, stage_result in run_stages(raw_results, seed, output_dir).items():
+                    stage_results[stage_name]['run_seconds'].append(stage_result['seconds'])
+            for stage_result in stage_results.values():
+                stage_result['seconds'] = min(stage_result['run_seconds'])
+            if trace_memory:
+                # Memory is measured in a separate run so tracing overhead doesn't skew the timings
+                memory_results = run_stages(raw_results, seed, output_dir, trace_memory=True)
+                for stage_name, memory_result in memory_results.items():
+                    stage_results[stage_name]['peak_bytes'] = memory_result['peak_bytes']
+            for stage_result in stage_results.values():
+                stage_result['records_per_second'] = size / stage_result['seconds'] if stage_result['seconds'] else None
+            stage_results_by_size[size] = stage_results
+            print('{:>9} users: {}'.format(size, ', '.join(
+                '{} {:.3f}s'.format(stage_name, stage_results[stage_name]['seconds']) for stage_name in STAGES
+            )))
+    return {
+        'seed': seed,
+        'sizes': sizes,
+        'repeat': repeat,
+        'results': [
+            dict(stage=stage_name, size=size, **stage_results_by_size[size][stage_name])
+            for size in sizes
+            for stage_name in STAGES
+        ],
+        'superlinear_stages': find_superlinear_stages(stage_results_by_size),
+        'import_times': import_times,
+        'over_import_budget': find_import_budget_violations(import_times),
+    }
+
+
+parser = argparse.ArgumentParser(description='''
+    Measures the time and peak memory of each data generation stage at increasing user counts, using synthetic
+    randomuser.me-shaped input, along with the time it takes to import the entry point modules. Results are saved
+    as JSON, and stages that scale superlinearly and imports that are over budget are flagged.
+''')
+parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                    help='User counts to benchmark (default: %(default)s)')
+parser.add_argument('--seed', default='benchmark', help='Seed for the synthetic input and generation')
+parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                    help='Number of timed runs per size. The fastest time of each stage is reported, and a stage is '
+                         'only flagged as superlinear if it is in every run (default: %(default)s)')
+parser.add_argument('--skip-memory', action='store_true',
+                    help="Don't measure peak memory, which takes an extra run per size")
+parser.add_argument('--output', default=BENCHMARK_RESULTS_PATH, help='Path of the results file (default: %(default)s)')
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    create_dir_if_none_exists(RESULT_DIR)
+    benchmark_results = run_benchmarks(
+        sorted(args.sizes),
+        args.seed,
+        trace_memory=not args.skip_memory,
+        repeat=args.repeat,
+    )
+    write_json_to_file(benchmark_results, args.output)
+    for flagged in benchmark_results['superlinear_stages']:
+        print('Superlinear: {stage} from {from_size} to {to_size} users (exponent {exponent})'.format(**flagged))
+    for module_name in benchmark_results['over_import_budget']:
+        import_time = benchmark_results['import_times'][module_name]
+        print('Over import budget: {} took {:.3f}s (budget {:.3f}s), deferred modules imported: {}'.format(
+            module_name, import_time['seconds'], import_time['budget_seconds'], import_time['deferred_modules']
+        ))
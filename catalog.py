@@ -0,0 +1,51 @@
+from api import NOW, build_course_run_calendar, create_past_course_runs
+from settings import PAST_COURSE_RUNS_TO_CREATE
+
+CATALOG_COURSES_PER_PROGRAM = 5
+CATALOG_PRICES = (750, 1000, 1500, 2000)
+
+
+class SyntheticCatalog:
+    """
+    Program catalog of any size, in the same shape as the output of build_full_program_data. Programs are
+    created as the catalog is iterated over, so a large catalog can be streamed to disk or into
+    fill_in_edx_data without all being held in memory, and iterating again creates the same programs.
+    The course run calendar is built once and shared by every course.
+    """
+    def __init__(self, program_count, courses_per_program=CATALOG_COURSES_PER_PROGRAM,
+                 runs_per_course=PAST_COURSE_RUNS_TO_CREATE, now=NOW):
+        if min(program_count, courses_per_program, runs_per_course) < 1:
+            raise ValueError('A catalog needs at least one program, course per program and run per course')
+        self.program_count = program_count
+        self.courses_per_program = courses_per_program
+        self.calendar = build_course_run_calendar(runs_per_course, now=now)
+
+    def __len__(self):
+        return self.program_count
+
+    def __iter__(self):
+        for program_index in range(self.program_count):
+            yield self.create_program(program_index)
+
+    def create_program(self, program_index):
+        title = 'Synthetic Program {}'.format(program_index + 1)
+        return {
+            'title': title,
+            'description': 'Learn stuff about {}.'.format(title),
+            'financial_aid_availability': program_index % 2 == 0,
+            '_price': CATALOG_PRICES[program_index % len(CATALOG_PRICES)],
+            'courses': [
+                self.create_course(title, position_in_program)
+                for position_in_program in range(1, self.courses_per_program + 1)
+            ],
+        }
+
+    def create_course(self, program_title, position_in_program):
+        title = '{} {}'.format(program_title, position_in_program * 100)
+        course_data = {
+            'title': title,
+            'position_in_program': position_in_program,
+            'description': 'Course {} of {}'.format(position_in_program, program_title),
+        }
+        course_data['course_runs'] = create_past_course_runs(course_data, calendar=self.calendar)
+        return course_data
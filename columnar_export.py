@@ -0,0 +1,221 @@
+import os
+from importlib.util import find_spec
+
+PARQUET_FORMAT = 'parquet'
+NPZ_FORMAT = 'npz'
+NPZ_FILE_NAME = 'realistic_user_data.npz'
+# Column name and kind for each table. 'dict' columns are dictionary-encoded (integer codes into a
+# table of distinct values), 'date' columns are stored as days, and the rest are plain values. The users
+# table's industry and company_name are those of the user's current employment.
+TABLE_COLUMN_KINDS = {
+    'users': [
+        ('first_name', 'str'),
+        ('last_name', 'str'),
+        ('date_of_birth', 'date'),
+        ('gender', 'dict'),
+        ('country', 'dict'),
+        ('state_or_territory', 'dict'),
+        ('city', 'dict'),
+        ('email', 'str'),
+        ('nationality', 'dict'),
+        ('industry', 'dict'),
+        ('company_name', 'dict'),
+        ('education_count', 'int8'),
+        ('work_history_count', 'int8'),
+        ('enrollment_count', 'int16'),
+        ('grade_count', 'int16'),
+    ],
+    'education': [
+        ('user_index', 'int32'),
+        ('degree_name', 'dict'),
+        ('graduation_date', 'date'),
+        ('school_name', 'dict'),
+        ('school_city', 'dict'),
+        ('school_state_or_territory', 'dict'),
+        ('school_country', 'dict'),
+        ('field_of_study', 'dict'),
+    ],
+    'work_history': [
+        ('user_index', 'int32'),
+        ('city', 'dict'),
+        ('country', 'dict'),
+        ('state_or_territory', 'dict'),
+        ('industry', 'dict'),
+        ('company_name', 'dict'),
+        ('position', 'dict'),
+        ('start_date', 'date'),
+        # None (null/NaT) for a current employment
+        ('end_date', 'date'),
+    ],
+    'enrollments': [
+        ('user_index', 'int32'),
+        ('edx_course_key', 'dict'),
+    ],
+    'grades': [
+        ('user_index', 'int32'),
+        ('edx_course_key', 'dict'),
+        ('grade', 'float32'),
+    ],
+}
+
+
+def columnar_format():
+    """
+    Gets the columnar format that can be written with the libraries that are installed. The libraries
+    themselves are only imported when something is written, since they're slow to import.
+    """
+    if find_spec('pyarrow') is not None:
+        return PARQUET_FORMAT
+    if find_spec('numpy') is not None:
+        return NPZ_FORMAT
+    return None
+
+
+def build_columns(user_records):
+    """Collects the values of every column of every table from user records, one user at a time"""
+    columns = {
+        table_name: {column_name: [] for column_name, _ in column_kinds}
+        for table_name, column_kinds in TABLE_COLUMN_KINDS.items()
+    }
+    users = columns['users']
+    education = columns['education']
+    work_history = columns['work_history']
+    enrollments = columns['enrollments']
+    grades = columns['grades']
+    for user_index, user in enumerate(user_records):
+        current_employment = user.work_history[0] if user.work_history else None
+        users['first_name'].append(user.first_name)
+        users['last_name'].append(user.last_name)
+        users['date_of_birth'].append(user.date_of_birth)
+        users['gender'].append(user.gender)
+        users['country'].append(user.country)
+        users['state_or_territory'].append(user.state_or_territory)
+        users['city'].append(user.city)
+        users['email'].append(user.email)
+        users['nationality'].append(user.original_country)
+        users['industry'].append(current_employment.industry if current_employment else None)
+        users['company_name'].append(current_employment.company_name if current_employment else None)
+        users['education_count'].append(len(user.education))
+        users['work_history_count'].append(len(user.work_history))
+        users['enrollment_count'].append(len(user.enrollments) if user.enrollments is not None else 0)
+        users['grade_count'].append(len(user.grades) if user.grades is not None else 0)
+        for education_record in user.education:
+            education['user_index'].append(user_index)
+            education['degree_name'].append(education_record.degree_name)
+            education['graduation_date'].append(education_record.graduation_date)
+            education['school_name'].append(education_record.school_name)
+            education['school_city'].append(education_record.school_city)
+            education['school_state_or_territory'].append(education_record.school_state_or_territory)
+            education['school_country'].append(education_record.school_country)
+            education['field_of_study'].append(education_record.field_of_study)
+        for employment_record in user.work_history:
+            work_history['user_index'].append(user_index)
+            work_history['city'].append(employment_record.city)
+            work_history['country'].append(employment_record.country)
+            work_history['state_or_territory'].append(employment_record.state_or_territory)
+            work_history['industry'].append(employment_record.industry)
+            work_history['company_name'].append(employment_record.company_name)
+            work_history['position'].append(employment_record.position)
+            work_history['start_date'].append(employment_record.start_date)
+            work_history['end_date'].append(employment_record.end_date)
+        for enrollment in user.enrollments or []:
+            enrollments['user_index'].append(user_index)
+            enrollments['edx_course_key'].append(enrollment['edx_course_key'])
+        for edx_course_key, grade in user.grades or []:
+            grades['user_index'].append(user_index)
+            grades['edx_course_key'].append(edx_course_key)
+            grades['grade'].append(float(grade))
+    return columns
+
+
+def dictionary_encode(values):
+    """Turns a list of values into (codes, categories), where a code of -1 represents None"""
+    import numpy
+
+    category_codes = {}
+    codes = numpy.empty(len(values), dtype=numpy.int32)
+    for i, value in enumerate(values):
+        if value is None:
+            codes[i] = -1
+        else:
+            codes[i] = category_codes.setdefault(value, len(category_codes))
+    return codes, numpy.array(list(category_codes.keys()), dtype=str)
+
+
+def write_parquet(columns, output_dir):
+    import pyarrow
+    import pyarrow.parquet
+
+    os.makedirs(output_dir, exist_ok=True)
+    for table_name, column_kinds in TABLE_COLUMN_KINDS.items():
+        arrays = []
+        for column_name, kind in column_kinds:
+            values = columns[table_name][column_name]
+            if kind == 'dict':
+                arrays.append(pyarrow.array(values, type=pyarrow.string()).dictionary_encode())
+            elif kind == 'date':
+                arrays.append(pyarrow.array(values, type=pyarrow.date32()))
+            elif kind == 'str':
+                arrays.append(pyarrow.array(values, type=pyarrow.string()))
+            else:
+                arrays.append(pyarrow.array(values, type=getattr(pyarrow, kind)()))
+        table = pyarrow.Table.from_arrays(arrays, names=[column_name for column_name, _ in column_kinds])
+        pyarrow.parquet.write_table(table, os.path.join(output_dir, '{}.parquet'.format(table_name)))
+
+
+def write_npz(columns, output_dir):
+    """
+    Writes every table to a single compressed .npz file. Array names are '<table>.<column>', and
+    dictionary-encoded columns are stored as '<table>.<column>.codes' and '<table>.<column>.categories'.
+    """
+    import numpy
+
+    os.makedirs(output_dir, exist_ok=True)
+    arrays = {}
+    for table_name, column_kinds in TABLE_COLUMN_KINDS.items():
+        for column_name, kind in column_kinds:
+            values = columns[table_name][column_name]
+            array_name = '{}.{}'.format(table_name, column_name)
+            if kind == 'dict':
+                (arrays[array_name + '.codes'], arrays[array_name + '.categories']) = dictionary_encode(values)
+            elif kind == 'date':
+                arrays[array_name] = numpy.array(values, dtype='datetime64[D]')
+            elif kind == 'str':
+                arrays[array_name] = numpy.array(values, dtype=str)
+            else:
+                arrays[array_name] = numpy.array(values, dtype=kind)
+    numpy.savez_compressed(os.path.join(output_dir, NPZ_FILE_NAME), **arrays)
+
+
+def write_columnar(user_records, output_dir, output_format=None):
+    """
+    Writes user records as columnar tables: Parquet if pyarrow is installed, otherwise a NumPy .npz file.
+    Returns the format that was written.
+    """
+    output_format = output_format or columnar_format()
+    if output_format is None:
+        raise RuntimeError('Columnar output requires either pyarrow or numpy to be installed')
+    columns = build_columns(user_records)
+    if output_format == PARQUET_FORMAT:
+        write_parquet(columns, output_dir)
+    else:
+        write_npz(columns, output_dir)
+    return output_format
+
+
+def load_npz_table(path, table_name):
+    """Loads one table from a .npz file written by write_npz, decoding dictionary-encoded columns"""
+    import numpy
+
+    with numpy.load(path) as npz:
+        table = {}
+        for column_name, kind in TABLE_COLUMN_KINDS[table_name]:
+            array_name = '{}.{}'.format(table_name, column_name)
+            if kind == 'dict':
+                codes = npz[array_name + '.codes']
+                categories = numpy.append(npz[array_name + '.categories'].astype(object), None)
+                # A code of -1 picks the None appended to the end of the categories
+                table[column_name] = categories[codes]
+            else:
+                table[column_name] = npz[array_name]
+    return table
@@ -0,0 +1,77 @@
+import random
+import struct
+from hashlib import blake2b
+
+BLOCK_WORDS = struct.Struct('<8Q')
+WORD_BITS = 64
+# Scales the top 53 bits of a 64-bit word to a float in [0, 1), as random.random does
+FLOAT_SCALE = 2.0 ** -53
+
+
+class CounterRandom(random.Random):
+    """
+    Random number generator whose stream is a pure function of a key: block n of the stream is the blake2b hash
+    of n, keyed with a hash of the key. Streams for different keys (eg: a master seed, a user index and a field
+    name) are independent, so each one can be created on its own without generating any of the others.
+    All of the random.Random methods are available, and are built on the 64-bit words of the stream.
+    """
+    def __init__(self, *key):
+        self.words = ()
+        self.word_position = 0
+        self.block_index = 0
+        super().__init__(key)
+
+    def seed(self, key=None, version=2):
+        if not isinstance(key, tuple):
+            key = (key,)
+        self.set_key_digest(blake2b(':'.join(str(part) for part in key).encode('utf-8'), digest_size=32).digest())
+        self.words = ()
+        self.word_position = 0
+        self.block_index = 0
+        self.gauss_next = None
+
+    def set_key_digest(self, key_digest):
+        self.key_digest = key_digest
+        # Each block is hashed from a copy of the keyed hasher, so the key is only processed once
+        self.block_hasher = blake2b(key=key_digest, digest_size=BLOCK_WORDS.size)
+
+    def next_word(self):
+        if self.word_position == len(self.words):
+            block_hasher = self.block_hasher.copy()
+            block_hasher.update(self.block_index.to_bytes(8, 'little'))
+            self.words = BLOCK_WORDS.unpack(block_hasher.digest())
+            self.block_index += 1
+            self.word_position = 0
+        word = self.words[self.word_position]
+        self.word_position += 1
+        return word
+
+    def random(self):
+        return (self.next_word() >> (WORD_BITS - 53)) * FLOAT_SCALE
+
+    def getrandbits(self, k):
+        if 0 < k <= WORD_BITS:
+            # The common case, for random.choice and random.randrange
+            return self.next_word() >> (WORD_BITS - k)
+        if k <= 0:
+            if k < 0:
+                raise ValueError('number of bits must be non-negative')
+            return 0
+        bits = 0
+        bit_count = 0
+        while bit_count < k:
+            bits = (bits << WORD_BITS) | self.next_word()
+            bit_count += WORD_BITS
+        return bits >> (bit_count - k)
+
+    def getstate(self):
+        return self.key_digest, self.block_index, self.words, self.word_position, self.gauss_next
+
+    def setstate(self, state):
+        (key_digest, self.block_index, self.words, self.word_position, self.gauss_next) = state
+        self.set_key_digest(key_digest)
+
+
+def counter_rng(seed, index, field):
+    """Creates the random stream for one field (eg: 'profile') of the item at an index, under a master seed"""
+    return CounterRandom(seed, index, field)
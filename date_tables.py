@@ -0,0 +1,65 @@
+import random
+
+from utils import (
+    date_from_randomuser_dob,
+    increment_year,
+    year_diff,
+)
+from settings import (
+    DEGREES,
+    EMPLOYMENT_YEAR_LENGTH,
+    GRAD_AGES,
+    MIN_AGE,
+)
+
+MAX_EMPLOYMENT_RECORDS = 2
+
+
+class UserDateTable:
+    """
+    Precomputed date values for users generated relative to a fixed 'now'. Values that only depend on a
+    user's DOB are computed once per distinct DOB and shared by every user born on that day, and values
+    that don't depend on the user at all are computed once for the whole table.
+    """
+    def __init__(self, now):
+        self.now = now
+        # DOBs that underage users are coerced to, in the same order as GRAD_AGES
+        self.coerced_dobs = [increment_year(now, -age).date() for age in GRAD_AGES]
+        # (start_date, end_date) for each employment record, starting with the current one
+        self.employment_dates = [
+            (
+                increment_year(now, -EMPLOYMENT_YEAR_LENGTH * (i + 1)).date(),
+                increment_year(now, -EMPLOYMENT_YEAR_LENGTH * i).date(),
+            )
+            for i in range(MAX_EMPLOYMENT_RECORDS)
+        ]
+        self.randomuser_dobs = {}
+        self.degrees = {}
+
+    def add_randomuser_dobs(self, dob_values):
+        """Parses a batch of randomuser.me DOB values and determines which of them are underage"""
+        for dob_value in dob_values:
+            dob_date_value = dob_value.split(' ')[0]
+            if dob_date_value not in self.randomuser_dobs:
+                dob = date_from_randomuser_dob(dob_date_value)
+                self.randomuser_dobs[dob_date_value] = (dob, year_diff(dob, self.now) < MIN_AGE)
+
+    def parse_randomuser_dob(self, dob_value, rng=random):
+        """Gets the DOB for a randomuser.me value, coercing underage users to a graduation age"""
+        (dob, is_underage) = self.randomuser_dobs[dob_value.split(' ')[0]]
+        if is_underage:
+            dob = rng.choice(self.coerced_dobs)
+        return dob
+
+    def degrees_earned(self, dob):
+        """Gets (degree_info, graduation_date) for every degree that a user born on the given date has earned"""
+        degrees = self.degrees.get(dob)
+        if degrees is None:
+            years_old = year_diff(dob, self.now)
+            degrees = [
+                (degree_info, increment_year(dob, degree_info['grad_age']))
+                for degree_info in DEGREES.values()
+                if years_old >= degree_info['grad_age']
+            ]
+            self.degrees[dob] = degrees
+        return degrees
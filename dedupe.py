@@ -0,0 +1,123 @@
+from array import array
+from hashlib import blake2b
+
+# Size of the Bloom filter that duplicate emails are detected with. False positives only cost an exact
+# check, so this trades memory against the number of emails that need that check.
+BLOOM_BITS_PER_KEY = 16
+WORD_MASK = (1 << 64) - 1
+
+
+def email_hash(email):
+    """64-bit hash of an email that's the same in every process"""
+    return int.from_bytes(blake2b(email.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def mix_hash(key_hash):
+    # splitmix64 finalizer
+    key_hash = ((key_hash ^ (key_hash >> 30)) * 0xbf58476d1ce4e5b9) & WORD_MASK
+    key_hash = ((key_hash ^ (key_hash >> 27)) * 0x94d049bb133111eb) & WORD_MASK
+    return key_hash ^ (key_hash >> 31)
+
+
+class BloomFilter:
+    """
+    Fixed-size set of 64-bit key hashes (see email_hash) that can report false positives but never false
+    negatives. It's a blocked filter: each key sets a handful of bits in a single 64-bit word, so adding or
+    checking a key is a few integer operations.
+    """
+    def __init__(self, capacity, bits_per_key=BLOOM_BITS_PER_KEY):
+        self.word_count = max(1, -(-capacity * bits_per_key // 64))
+        self.words = array('Q', bytes(8 * self.word_count))
+
+    def word_index_and_mask(self, key_hash):
+        mixed = mix_hash(key_hash)
+        # ANDing three (roughly independent) 64-bit values derived from the mixed hash leaves 8 bits set on average
+        mask = mixed & (mixed * 0x9e3779b97f4a7c15 & WORD_MASK) & (mixed * 0xd6e8feb86659fd93 & WORD_MASK)
+        return key_hash % self.word_count, mask or 1 << (mixed & 63)
+
+    def add(self, key_hash):
+        """Adds a key hash to the filter and returns whether it might have been added before"""
+        (word_index, mask) = self.word_index_and_mask(key_hash)
+        word = self.words[word_index]
+        if word & mask == mask:
+            return True
+        self.words[word_index] = word | mask
+        return False
+
+    def __contains__(self, key_hash):
+        (word_index, mask) = self.word_index_and_mask(key_hash)
+        return self.words[word_index] & mask == mask
+
+
+def make_unique_email(email, taken_emails, next_suffixes=None):
+    """
+    Adds the lowest '+N' suffix to the local part of an email that isn't already taken. If a next_suffixes
+    dict is given, it records where to start for the next duplicate of the same email, so an email with
+    many duplicates doesn't check the same suffixes over and over.
+    """
+    (local_part, domain) = email.rsplit('@', 1)
+    suffix = next_suffixes.get(email, 1) if next_suffixes is not None else 1
+    unique_email = '{}+{}@{}'.format(local_part, suffix, domain)
+    while unique_email in taken_emails:
+        suffix += 1
+        unique_email = '{}+{}@{}'.format(local_part, suffix, domain)
+    if next_suffixes is not None:
+        next_suffixes[email] = suffix + 1
+    return unique_email
+
+
+def indexed_email(email, index):
+    """
+    Adds a user's index as a '+N' suffix to the local part of their email. Emails made this way are unique
+    without checking them against any other user's email.
+    """
+    (local_part, domain) = email.rsplit('@', 1)
+    return '{}+{}@{}'.format(local_part, index, domain)
+
+
+class EmailDeduplicator:
+    """
+    Makes emails unique in two passes over the same users in the same order. The first pass adds the hash of
+    every email to a Bloom filter, and the emails it has possibly seen before become candidates. The second
+    pass calls unique_email for each user: the first user with an email keeps it, and later users with the
+    same email get a '+N' suffix (see make_unique_email). Only candidates are checked exactly, so memory use
+    stays at a couple of bytes per user plus the (small) set of candidate duplicates.
+    """
+    def __init__(self, capacity, bits_per_key=BLOOM_BITS_PER_KEY):
+        self.bloom_filter = BloomFilter(capacity, bits_per_key=bits_per_key)
+        self.candidate_hashes = set()
+        self.kept_emails = set()
+        self.next_suffixes = {}
+        self.rewritten_count = 0
+
+    def add_email_hash(self, key_hash):
+        if self.bloom_filter.add(key_hash):
+            self.candidate_hashes.add(key_hash)
+
+    def __contains__(self, email):
+        """Whether an email might already be taken"""
+        return email_hash(email) in self.bloom_filter
+
+    def unique_email(self, email):
+        if not self.candidate_hashes or email_hash(email) not in self.candidate_hashes:
+            return email
+        if email not in self.kept_emails:
+            self.kept_emails.add(email)
+            return email
+        # Every original email is already in the filter, so a suffixed email that it hasn't seen is unique.
+        # Skipping suffixes the filter has falsely seen is harmless and keeps the output deterministic.
+        unique_email = make_unique_email(email, self, self.next_suffixes)
+        self.bloom_filter.add(email_hash(unique_email))
+        self.rewritten_count += 1
+        return unique_email
+
+
+def dedupe_user_emails(all_user_data, bits_per_key=BLOOM_BITS_PER_KEY):
+    """Gives every user a unique email (see EmailDeduplicator). Returns the number of emails that were rewritten."""
+    deduplicator = EmailDeduplicator(len(all_user_data), bits_per_key=bits_per_key)
+    for user in all_user_data:
+        deduplicator.add_email_hash(email_hash(user.email))
+    if deduplicator.candidate_hashes:
+        for user in all_user_data:
+            user.email = deduplicator.unique_email(user.email)
+    return deduplicator.rewritten_count
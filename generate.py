@@ -1,43 +1,401 @@
 import os
+import sys
+import random
 import argparse
 
 from utils import (
     create_dir_if_none_exists,
+    iter_json_records_from_file,
     load_json_from_file,
     write_json_to_file,
+    write_json_lines_to_file,
+    write_json_array_to_file,
+    compressed_path,
+    derive_rng,
+    COMPRESSION_OPENERS,
 )
-from randomuser_client import get_all_user_api_results
+from randomuser_client import (
+    get_all_user_api_results,
+    get_api_results_from_metadata,
+    determine_user_count_per_group,
+    create_param_groups,
+    STATE_LOOKUP_MISSES,
+    RANDOMUSER_URL,
+    API_CONCURRENCY,
+)
+from localuser_client import (
+    get_all_local_user_results,
+    local_user_iter,
+    LOCAL_SOURCE_NAME,
+)
+from settings import USERS_TO_GENERATE, PAST_COURSE_RUNS_TO_CREATE
 from api import (
     build_full_program_data,
-    create_user_from_result,
+    create_users_from_results,
     edit_full_user_data,
     fill_in_edx_data
 )
+from records import serialize_users
+from relational_export import write_relational_csv, write_relational_sqlite
+from columnar_export import write_columnar, columnar_format
+from dedupe import dedupe_user_emails
+from catalog import SyntheticCatalog, CATALOG_COURSES_PER_PROGRAM
+from streaming import plan_streaming_generation, iter_streamed_users
+from per_user import PerUserGenerator, LocalResultSource, iter_per_user_users
+from incremental import load_existing_user_index, make_user_emails_unique, append_user_data
+from offset_index import OffsetIndexBuilder, offset_index_path
+from metrics import (
+    GenerationMetrics,
+    NULL_METRICS,
+    STAGES,
+    FETCH_STAGE,
+    INDEX_STAGE,
+    PARSE_STAGE,
+    DEDUPE_STAGE,
+    EDIT_STAGE,
+    EDX_STAGE,
+    WRITE_STAGE,
+    STREAM_STAGE,
+    PER_USER_STAGE,
+)
 from path import (
     API_RESULT_DATA_PATH,
     API_METADATA_PATH,
+    LOCAL_RESULT_DATA_PATH,
+    LOCAL_METADATA_PATH,
     RESULT_PROGRAM_DATA_PATH,
     USER_DATA_PATH,
     RESULT_DIR,
-    RESULT_DIR_NAME
+    RESULT_DIR_NAME,
+    GENERATION_METRICS_PATH,
+    GENERATION_PROFILE_PATH_PREFIX,
+    RELATIONAL_CSV_DIR,
+    SQLITE_DB_PATH,
+    COLUMNAR_DIR,
 )
 
+JSON_FORMAT = 'json'
+JSON_LINES_FORMAT = 'jsonl'
+
+
+def fetch_api_results(save=True, base_url=RANDOMUSER_URL, concurrency=API_CONCURRENCY, seed=None, use_cache=True,
+                      user_count=USERS_TO_GENERATE):
+    (api_result_data, api_call_metadata) = get_all_user_api_results(
+        base_url=base_url,
+        concurrency=concurrency,
+        seed=seed,
+        use_cache=use_cache,
+        user_count=user_count,
+    )
+    if save:
+        write_json_to_file(api_result_data, API_RESULT_DATA_PATH)
+        write_json_to_file(api_call_metadata, API_METADATA_PATH)
+    return api_result_data
+
 
-def fetch_api_results(save=True):
-    (api_result_data, api_call_metadata) = get_all_user_api_results()
+def rebuild_api_results(save=True, concurrency=API_CONCURRENCY, use_cache=True):
+    """Rebuilds randomuser.me results from the urls and seeds recorded in the saved metadata"""
+    api_call_metadata = load_json_from_file(API_METADATA_PATH)
+    if not all('url' in call_metadata for call_metadata in api_call_metadata):
+        parser.error("{} doesn't hold randomuser.me request metadata, so results can't be rebuilt from it".format(
+            os.path.relpath(API_METADATA_PATH)
+        ))
+    (api_result_data, api_call_metadata) = get_api_results_from_metadata(
+        api_call_metadata,
+        concurrency=concurrency,
+        use_cache=use_cache,
+    )
     if save:
         write_json_to_file(api_result_data, API_RESULT_DATA_PATH)
         write_json_to_file(api_call_metadata, API_METADATA_PATH)
     return api_result_data
 
 
-def generate_user_and_program_data(api_result_data):
-    program_data = build_full_program_data()
-    write_json_to_file(program_data, RESULT_PROGRAM_DATA_PATH)
-    user_data = [create_user_from_result(user_result) for user_result in api_result_data]
-    user_data = edit_full_user_data(user_data)
-    user_data = fill_in_edx_data(user_data, program_data)
-    write_json_to_file(user_data, USER_DATA_PATH)
+def create_local_results(save=False, seed=None, user_count=USERS_TO_GENERATE):
+    (user_result_data, generation_metadata) = get_all_local_user_results(seed=seed, user_count=user_count)
+    if save:
+        # Local results are kept apart from saved randomuser.me results, which later runs read by default
+        write_json_to_file(user_result_data, LOCAL_RESULT_DATA_PATH)
+        write_json_to_file(generation_metadata, LOCAL_METADATA_PATH)
+    return user_result_data
+
+
+def write_user_data(user_data, output_format=JSON_FORMAT, compression=None, offset_index=False):
+    """Writes user data, along with an offset index for random access (see offset_index) if offset_index is True"""
+    user_data_path = compressed_path(USER_DATA_PATH, compression)
+    user_dicts = serialize_users(user_data)
+    index_builder = None
+    if offset_index:
+        index_builder = OffsetIndexBuilder()
+        user_dicts = index_builder.track(user_dicts)
+    if output_format == JSON_LINES_FORMAT:
+        write_file = write_json_lines_to_file
+    else:
+        write_file = write_json_array_to_file
+    write_file(
+        user_dicts,
+        user_data_path,
+        compression=compression,
+        record_offsets=index_builder.offsets if index_builder else None,
+    )
+    index_path = offset_index_path(user_data_path)
+    if index_builder:
+        index_builder.write(index_path, os.path.getsize(user_data_path))
+    elif os.path.isfile(index_path):
+        # An index of the previous user data would point into the wrong records
+        os.remove(index_path)
+
+
+def write_program_data(program_data=None):
+    """Writes program data (built from the base program data if none is given), streaming one program at a time"""
+    if program_data is None:
+        program_data = build_full_program_data()
+    write_json_array_to_file(program_data, RESULT_PROGRAM_DATA_PATH)
+    return program_data
+
+
+def generate_user_and_program_data(api_result_data, output_format=JSON_FORMAT, compression=None, seed=None,
+                                   workers=1, metrics=NULL_METRICS, relational_csv=False, sqlite=False,
+                                   columnar=False, program_data=None, offset_index=False):
+    """
+    Generates and writes user and program data. Program data is built from the base program data unless it's
+    given (eg: a SyntheticCatalog). Returns the number of duplicate emails that were rewritten.
+    """
+    program_data = write_program_data(program_data)
+    with metrics.stage(PARSE_STAGE):
+        user_data = create_users_from_results(api_result_data, seed=seed, workers=workers)
+    metrics.count(PARSE_STAGE, len(user_data))
+    with metrics.stage(DEDUPE_STAGE):
+        rewritten_email_count = dedupe_user_emails(user_data)
+    metrics.count(DEDUPE_STAGE, len(user_data))
+    with metrics.stage(EDIT_STAGE):
+        if seed is None:
+            user_data = edit_full_user_data(user_data)
+        else:
+            user_data = edit_full_user_data(user_data, rng=derive_rng(seed, 'edit'))
+    metrics.count(EDIT_STAGE, len(user_data))
+    with metrics.stage(EDX_STAGE):
+        if seed is None:
+            user_data = fill_in_edx_data(user_data, program_data)
+        else:
+            user_data = fill_in_edx_data(user_data, program_data, rng=derive_rng(seed, 'edx'))
+    metrics.count(EDX_STAGE, len(user_data))
+    with metrics.stage(WRITE_STAGE):
+        write_user_data(user_data, output_format=output_format, compression=compression, offset_index=offset_index)
+        if relational_csv:
+            write_relational_csv(serialize_users(user_data), program_data, RELATIONAL_CSV_DIR)
+        if sqlite:
+            write_relational_sqlite(serialize_users(user_data), program_data, SQLITE_DB_PATH)
+        if columnar:
+            write_columnar(user_data, COLUMNAR_DIR)
+    metrics.count(WRITE_STAGE, len(user_data))
+    return rewritten_email_count
+
+
+def append_to_user_data(api_result_data, user_data_path, program_data, existing_user_index, seed=None, workers=1,
+                        metrics=NULL_METRICS, offset_index=False):
+    """
+    Creates users from new raw results and adds them to an existing user data file. The new users get the same
+    nationality swap and enrollment/grade distributions as a full run, drawing on the existing users' locations
+    and evening out the number of users in each program. Returns the number of emails that had to be rewritten
+    to keep them unique.
+    """
+    with metrics.stage(PARSE_STAGE):
+        user_data = create_users_from_results(api_result_data, seed=seed, workers=workers)
+    metrics.count(PARSE_STAGE, len(user_data))
+    with metrics.stage(DEDUPE_STAGE):
+        rewritten_email_count = make_user_emails_unique(user_data, existing_user_index.emails)
+    metrics.count(DEDUPE_STAGE, len(user_data))
+    with metrics.stage(EDIT_STAGE):
+        user_data = edit_full_user_data(
+            user_data,
+            rng=derive_rng(seed, 'edit') if seed is not None else random,
+            location_index=existing_user_index.location_index,
+        )
+    metrics.count(EDIT_STAGE, len(user_data))
+    with metrics.stage(EDX_STAGE):
+        user_data = fill_in_edx_data(
+            user_data,
+            program_data,
+            rng=derive_rng(seed, 'edx') if seed is not None else random,
+            program_user_counts=existing_user_index.program_user_counts,
+        )
+    metrics.count(EDX_STAGE, len(user_data))
+    with metrics.stage(WRITE_STAGE):
+        append_user_data(serialize_users(user_data), user_data_path, offset_index=offset_index)
+    metrics.count(WRITE_STAGE, len(user_data))
+    return rewritten_email_count
+
+
+def generate_streaming_user_and_program_data(user_results_source, output_format=JSON_FORMAT, compression=None,
+                                             seed=None, workers=1, metrics=NULL_METRICS, program_data=None,
+                                             offset_index=False):
+    """
+    Generates and writes user and program data in two passes over raw results, so only a few compact keys per
+    user are held in memory instead of every user. user_results_source is a function that returns a new
+    iterator over the same raw results each time it's called. The output is the same as
+    generate_user_and_program_data with the same seed. Returns the number of duplicate emails that were rewritten.
+    """
+    if seed is None:
+        seed = '{:016x}'.format(random.getrandbits(64))
+    program_data = write_program_data(program_data)
+    with metrics.stage(INDEX_STAGE):
+        plan = plan_streaming_generation(user_results_source(), program_data, seed)
+    metrics.count(INDEX_STAGE, plan.user_count)
+    with metrics.stage(STREAM_STAGE):
+        write_user_data(
+            iter_streamed_users(user_results_source(), plan, seed, workers=workers),
+            output_format=output_format,
+            compression=compression,
+            offset_index=offset_index,
+        )
+    metrics.count(STREAM_STAGE, plan.user_count)
+    return plan.deduplicator.rewritten_count
+
+
+def generate_per_user_data(user_results, output_format=JSON_FORMAT, compression=None, seed=None, workers=1,
+                           metrics=NULL_METRICS, program_data=None, user_range=slice(None), offset_index=False,
+                           country_user_indices=None):
+    """
+    Generates and writes program data and the users in a slice of the raw results' indices, creating each user
+    independently of the others (see per_user.PerUserGenerator). A user has the same data with the same seed,
+    whichever slice they're generated in.
+    """
+    program_data = write_program_data(program_data)
+    generator = PerUserGenerator(seed, user_results, program_data, country_user_indices=country_user_indices)
+    user_count = len(range(*user_range.indices(len(generator))))
+    with metrics.stage(PER_USER_STAGE):
+        write_user_data(
+            iter_per_user_users(generator, user_range=user_range, workers=workers),
+            output_format=output_format,
+            compression=compression,
+            offset_index=offset_index,
+        )
+    metrics.count(PER_USER_STAGE, user_count)
+
+
+def load_raw_results_source(args):
+    """
+    Gets a function that iterates over raw user results from the source selected by the command line args.
+    Results are always re-read from disk or regenerated from a seed, so they never all need to be in memory.
+    """
+    if args.source == LOCAL_SOURCE_NAME:
+        user_count_per_group = determine_user_count_per_group()
+        return lambda: local_user_iter(user_count_per_group, args.seed)
+    if args.rebuild_from_metadata:
+        rebuild_api_results(save=True, concurrency=args.concurrency, use_cache=not args.no_api_cache)
+    elif not os.path.isfile(API_RESULT_DATA_PATH) or args.create_from_api or args.save_api_results:
+        # Fetched results are saved so that both passes can read them back from the file
+        fetch_api_results(
+            save=True,
+            base_url=args.api_url,
+            concurrency=args.concurrency,
+            seed=args.seed,
+            use_cache=not args.no_api_cache,
+        )
+    return lambda: iter_json_records_from_file(API_RESULT_DATA_PATH)
+
+
+def load_raw_results(args):
+    """Gets raw user results from the source selected by the command line args"""
+    api_results_exist = os.path.isfile(API_RESULT_DATA_PATH)
+    if args.source == LOCAL_SOURCE_NAME:
+        return create_local_results(save=args.save_api_results, seed=args.seed)
+    elif args.rebuild_from_metadata:
+        return rebuild_api_results(
+            save=args.save_api_results,
+            concurrency=args.concurrency,
+            use_cache=not args.no_api_cache,
+        )
+    elif not api_results_exist or args.create_from_api or args.save_api_results:
+        # save results if the flag was set or if the results don't exist yet
+        save_results = args.save_api_results or not api_results_exist
+        return fetch_api_results(
+            save=save_results,
+            base_url=args.api_url,
+            concurrency=args.concurrency,
+            seed=args.seed,
+            use_cache=not args.no_api_cache,
+        )
+    # Cached results are read lazily as users are created
+    return iter_json_records_from_file(API_RESULT_DATA_PATH)
+
+
+def load_indexed_raw_results(args, seed):
+    """
+    Gets raw user results that can be looked up by index, and the indices of the results for each country if
+    they're known without reading every result
+    """
+    if args.source == LOCAL_SOURCE_NAME:
+        user_results = LocalResultSource(seed)
+        return user_results, user_results.country_user_indices
+    return list(load_raw_results(args)), None
+
+
+def load_new_raw_results(args, user_count, seed):
+    """
+    Gets raw results for users that will be appended to existing user data. These are never saved, since
+    they would replace the saved results of the existing users.
+    """
+    if args.source == LOCAL_SOURCE_NAME:
+        return create_local_results(seed=seed, user_count=user_count)
+    return fetch_api_results(
+        save=False,
+        base_url=args.api_url,
+        concurrency=args.concurrency,
+        seed=seed,
+        use_cache=not args.no_api_cache,
+        user_count=user_count,
+    )
+
+
+def append_users(args, metrics):
+    user_data_path = compressed_path(USER_DATA_PATH, args.compression)
+    if not os.path.isfile(user_data_path) or not os.path.isfile(RESULT_PROGRAM_DATA_PATH):
+        parser.error('--append needs existing user and program data ({} and {})'.format(
+            os.path.relpath(user_data_path), os.path.relpath(RESULT_PROGRAM_DATA_PATH)
+        ))
+    # Existing course runs are kept so that new enrollments refer to the same course keys
+    program_data = load_json_from_file(RESULT_PROGRAM_DATA_PATH)
+    with metrics.stage(FETCH_STAGE):
+        existing_user_index = load_existing_user_index(user_data_path, program_data)
+        # Each append with the same master seed adds a different set of users
+        seed = None if args.seed is None else '{}:append:{}'.format(args.seed, existing_user_index.user_count)
+        api_results = load_new_raw_results(args, args.append, seed)
+    metrics.count(FETCH_STAGE, len(api_results))
+    rewritten_email_count = append_to_user_data(
+        api_results,
+        user_data_path,
+        program_data,
+        existing_user_index,
+        seed=seed,
+        workers=args.workers,
+        metrics=metrics,
+        # An existing offset index is kept up to date
+        offset_index=os.path.isfile(offset_index_path(user_data_path)),
+    )
+    print('Appended {} users to {} existing users'.format(len(api_results), existing_user_index.user_count))
+    return rewritten_email_count
+
+
+def parse_user_range(value):
+    """Parses a 'START:STOP' range of user indices, where either end can be left out (eg: '1000:', ':50')"""
+    try:
+        (start, stop) = value.split(':')
+        return slice(int(start) if start else None, int(stop) if stop else None)
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected START:STOP, got {!r}'.format(value))
+
+
+def positive_int(value):
+    """Parses a whole number that's at least 1"""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected a whole number, got {!r}'.format(value))
+    if number < 1:
+        raise argparse.ArgumentTypeError('must be at least 1, got {}'.format(number))
+    return number
 
 
 parser = argparse.ArgumentParser(description='''
@@ -47,16 +405,166 @@ parser = argparse.ArgumentParser(description='''
      requests to randomuser.me. Result JSON files will be saved in the '{}' directory.
 '''.format(RESULT_DIR_NAME))
 parser.add_argument('--create-from-api', action='store_true', help='Generate data from new randomuser.me API results')
-parser.add_argument('--save-api-results', action='store_true', help='Save randomuser.me API results')
+parser.add_argument('--save-api-results', action='store_true',
+                    help='Save randomuser.me API results (or, with --source {}, the local results to {})'.format(
+                        LOCAL_SOURCE_NAME, os.path.relpath(LOCAL_RESULT_DATA_PATH)
+                    ))
+parser.add_argument('--api-url', default=RANDOMUSER_URL, help='Base URL of the randomuser.me-compatible API')
+parser.add_argument('--concurrency', type=int, default=API_CONCURRENCY,
+                    help='Number of concurrent randomuser.me requests (default: %(default)s)')
+parser.add_argument('--no-api-cache', action='store_true',
+                    help="Don't read or write the per-request cache of randomuser.me responses")
+parser.add_argument('--rebuild-from-metadata', action='store_true',
+                    help='Rebuild randomuser.me results from the urls and seeds in the saved API metadata')
+parser.add_argument('--source', choices=['api', LOCAL_SOURCE_NAME], default='api',
+                    help="Where raw user records come from: randomuser.me ('api') or the offline local generator "
+                         "('{}')".format(LOCAL_SOURCE_NAME))
+parser.add_argument('--seed', help='Master seed for the offline local generator and for user/enrollment generation. '
+                                   'The same seed produces the same output no matter how many workers are used.')
+parser.add_argument('--workers', type=int, default=1,
+                    help='Number of processes used to create users from raw results (default: %(default)s)')
+parser.add_argument('--output-format', choices=[JSON_FORMAT, JSON_LINES_FORMAT], default=JSON_FORMAT,
+                    help="Format of the user data file: pretty-printed JSON ('{}') or one compact record per line "
+                         "('{}')".format(JSON_FORMAT, JSON_LINES_FORMAT))
+parser.add_argument('--compression', choices=sorted(COMPRESSION_OPENERS.keys()),
+                    help='Compress the user data file')
+parser.add_argument('--relational-csv', action='store_true',
+                    help='Also write users/programs as COPY-ready CSV tables (plus a schema.sql) to {}'.format(
+                        os.path.relpath(RELATIONAL_CSV_DIR)
+                    ))
+parser.add_argument('--sqlite', action='store_true',
+                    help='Also load users/programs into relational tables in {}'.format(
+                        os.path.relpath(SQLITE_DB_PATH)
+                    ))
+parser.add_argument('--catalog-programs', type=positive_int, metavar='N',
+                    help='Use a synthetic catalog of N programs instead of the base program data')
+parser.add_argument('--catalog-courses-per-program', type=positive_int, default=CATALOG_COURSES_PER_PROGRAM,
+                    help='Number of courses in each synthetic catalog program (default: %(default)s)')
+parser.add_argument('--catalog-runs-per-course', type=positive_int, default=PAST_COURSE_RUNS_TO_CREATE,
+                    help='Number of past runs of each synthetic catalog course (default: %(default)s)')
+parser.add_argument('--streaming', action='store_true',
+                    help='Generate users in two passes over the raw results, keeping only compact per-user keys in '
+                         'memory. Output is the same as a normal run with the same --seed.')
+parser.add_argument('--per-user', action='store_true',
+                    help='Create every user independently of the others, with random draws keyed by --seed, the '
+                         "user's index and the field being generated. Any user or range of users (see "
+                         '--user-range) can then be regenerated on its own with the same result.')
+parser.add_argument('--user-range', type=parse_user_range, metavar='START:STOP',
+                    help='With --per-user, only generate users with indices in [START, STOP)')
+parser.add_argument('--append', type=positive_int, metavar='N',
+                    help='Add about N new users to the existing user data file instead of regenerating it. The '
+                         'file keeps its existing format, and existing records are left unchanged.')
+parser.add_argument('--columnar', action='store_true',
+                    help='Also write users as columnar tables to {} (Parquet if pyarrow is installed, '
+                         'otherwise a NumPy .npz file)'.format(os.path.relpath(COLUMNAR_DIR)))
+parser.add_argument('--offset-index', action='store_true',
+                    help='Also write a binary index of user record offsets and email hashes next to the user data '
+                         'file, for random access with offset_index.OffsetIndexReader (not with --compression)')
+parser.add_argument('--metrics', action='store_true',
+                    help='Save wall/CPU time, peak RSS and record counts for each stage to {}'.format(
+                        os.path.relpath(GENERATION_METRICS_PATH)
+                    ))
+parser.add_argument('--profile', choices=STAGES,
+                    help='Run a stage under cProfile and tracemalloc and dump the results (implies --metrics)')
 
 if __name__ == "__main__":
     args = parser.parse_args()
     create_dir_if_none_exists(RESULT_DIR)
-    api_results_exist = os.path.isfile(API_RESULT_DATA_PATH)
-    if not api_results_exist or args.create_from_api or args.save_api_results:
-        # save results if the flag was set or if the results don't exist yet
-        save_results = args.save_api_results or not api_results_exist
-        api_results = fetch_api_results(save=save_results)
+    if args.metrics or args.profile:
+        metrics = GenerationMetrics(profile_stage=args.profile, profile_path_prefix=GENERATION_PROFILE_PATH_PREFIX)
+    else:
+        metrics = NULL_METRICS
+    if args.offset_index and args.compression:
+        parser.error('--offset-index needs an uncompressed user data file, and can\'t be combined with --compression')
+    if args.columnar and columnar_format() is None:
+        parser.error('--columnar needs either pyarrow or numpy to be installed')
+    if args.catalog_programs is not None:
+        program_data = SyntheticCatalog(
+            args.catalog_programs,
+            courses_per_program=args.catalog_courses_per_program,
+            runs_per_course=args.catalog_runs_per_course,
+        )
+    else:
+        program_data = None
+    if args.user_range is not None and not args.per_user:
+        parser.error('--user-range only applies to --per-user')
+    if args.seed is None and (args.per_user or args.source == LOCAL_SOURCE_NAME):
+        # Every user comes from the seed, so a random one is logged for the run to be reproduced with --seed
+        args.seed = '{:016x}'.format(random.getrandbits(64))
+        print('Generating users with seed {}'.format(args.seed), file=sys.stderr)
+    if args.append is not None:
+        if args.per_user or args.streaming:
+            parser.error('--append can\'t be combined with --per-user or --streaming')
+        if args.catalog_programs is not None:
+            parser.error('--append uses the existing program data, and can\'t be combined with --catalog-programs')
+        if args.relational_csv or args.sqlite or args.columnar:
+            parser.error('--append only adds to the user data file, and can\'t be combined with other outputs')
+        # Users are added in equal groups (see determine_user_count_per_group), so less than one per group is none
+        if args.append < len(create_param_groups()):
+            parser.error('--append needs at least {} users'.format(len(create_param_groups())))
+        rewritten_email_count = append_users(args, metrics)
+    elif args.per_user:
+        if args.streaming:
+            parser.error('--per-user already generates users one at a time, and can\'t be combined with --streaming')
+        if args.relational_csv or args.sqlite or args.columnar:
+            parser.error('--per-user only writes the user data file, and can\'t be combined with other outputs')
+        with metrics.stage(FETCH_STAGE):
+            (api_results, country_user_indices) = load_indexed_raw_results(args, args.seed)
+        generate_per_user_data(
+            api_results,
+            output_format=args.output_format,
+            compression=args.compression,
+            seed=args.seed,
+            workers=args.workers,
+            metrics=metrics,
+            program_data=program_data,
+            user_range=args.user_range or slice(None),
+            offset_index=args.offset_index,
+            country_user_indices=country_user_indices,
+        )
+        # Emails are made unique by construction
+        rewritten_email_count = 0
+    elif args.streaming:
+        if args.relational_csv or args.sqlite or args.columnar:
+            parser.error('--streaming only writes the user data file, and can\'t be combined with other outputs')
+        with metrics.stage(FETCH_STAGE):
+            user_results_source = load_raw_results_source(args)
+        rewritten_email_count = generate_streaming_user_and_program_data(
+            user_results_source,
+            output_format=args.output_format,
+            compression=args.compression,
+            seed=args.seed,
+            workers=args.workers,
+            metrics=metrics,
+            program_data=program_data,
+            offset_index=args.offset_index,
+        )
     else:
-        api_results = load_json_from_file(API_RESULT_DATA_PATH)
-    generate_user_and_program_data(api_results)
+        with metrics.stage(FETCH_STAGE):
+            api_results = load_raw_results(args)
+        if isinstance(api_results, list):
+            metrics.count(FETCH_STAGE, len(api_results))
+        rewritten_email_count = generate_user_and_program_data(
+            api_results,
+            output_format=args.output_format,
+            compression=args.compression,
+            seed=args.seed,
+            workers=args.workers,
+            metrics=metrics,
+            relational_csv=args.relational_csv,
+            sqlite=args.sqlite,
+            columnar=args.columnar,
+            program_data=program_data,
+            offset_index=args.offset_index,
+        )
+    if metrics is not NULL_METRICS:
+        metrics_data = metrics.to_dict()
+        metrics_data['state_lookup_misses'] = dict(STATE_LOOKUP_MISSES)
+        metrics_data['rewritten_email_count'] = rewritten_email_count
+        write_json_to_file(metrics_data, GENERATION_METRICS_PATH)
+    if rewritten_email_count:
+        print('Rewrote {} duplicate emails to keep emails unique'.format(rewritten_email_count), file=sys.stderr)
+    if STATE_LOOKUP_MISSES:
+        print('State lookup misses that fell back to a default state: {}'.format(
+            dict(STATE_LOOKUP_MISSES)
+        ), file=sys.stderr)
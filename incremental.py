@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+from collections import defaultdict
+from itertools import chain
+
+from utils import (
+    iter_json_records_from_file,
+    is_json_array_file,
+    compression_from_path,
+    write_json_array_to_file,
+    write_json_lines_to_file,
+)
+from dedupe import make_unique_email
+from offset_index import OffsetIndexBuilder, offset_index_path
+
+
+class ExistingUserIndex:
+    """
+    Keys of a previously generated user data file that new users are generated against: the emails that are
+    taken, every user's location (grouped by country) and the number of users enrolled in each program
+    """
+    def __init__(self, all_program_data):
+        self.user_count = 0
+        self.emails = set()
+        self.location_index = defaultdict(list)
+        self.program_user_counts = [0] * len(all_program_data)
+        self.course_key_programs = {
+            course_run['edx_course_key']: program_index
+            for program_index, program_data in enumerate(all_program_data)
+            for course_data in program_data['courses']
+            for course_run in course_data['course_runs']
+        }
+        # Identical locations share a single tuple, since there are far fewer locations than users
+        self.locations = {}
+
+    def add(self, user_dict):
+        self.user_count += 1
+        self.emails.add(user_dict['email'])
+        location = (user_dict['country'], user_dict['state_or_territory'], user_dict['city'])
+        self.location_index[location[0]].append(self.locations.setdefault(location, location))
+        program_indices = {
+            self.course_key_programs[enrollment['edx_course_key']]
+            for enrollment in user_dict.get('_enrollments', [])
+        }
+        for program_index in program_indices:
+            self.program_user_counts[program_index] += 1
+
+
+def load_existing_user_index(user_data_path, all_program_data):
+    """Builds an index of an existing user data file, reading one record at a time"""
+    existing_user_index = ExistingUserIndex(all_program_data)
+    for user_dict in iter_json_records_from_file(user_data_path):
+        existing_user_index.add(user_dict)
+    return existing_user_index
+
+
+def make_user_emails_unique(all_user_data, taken_emails):
+    """
+    Rewrites the email of any user whose email is already taken (by an existing user or an earlier new user).
+    taken_emails is updated with the new users' emails. Returns the number of emails that were rewritten.
+    """
+    next_suffixes = {}
+    rewritten_count = 0
+    for user in all_user_data:
+        if user.email in taken_emails:
+            user.email = make_unique_email(user.email, taken_emails, next_suffixes)
+            rewritten_count += 1
+        taken_emails.add(user.email)
+    return rewritten_count
+
+
+def append_user_data(user_dicts, user_data_path, offset_index=False):
+    """
+    Adds serialized users to the end of an existing user data file. JSON Lines files are appended to in
+    place. A JSON array can't be, so the existing records are streamed into a new file followed by the
+    new ones, and the new file replaces the old one. Either way, existing records are written unchanged.
+    If offset_index is True, the file's offset index is updated to include the new records.
+    """
+    compression = compression_from_path(user_data_path)
+    index_path = offset_index_path(user_data_path)
+    if not is_json_array_file(user_data_path):
+        index_builder = OffsetIndexBuilder.from_index_file(user_data_path) if offset_index else None
+        write_json_lines_to_file(
+            index_builder.track(user_dicts) if index_builder else user_dicts,
+            user_data_path,
+            compression=compression,
+            append=True,
+            record_offsets=index_builder.offsets if index_builder else None,
+        )
+        if index_builder:
+            index_builder.write(index_path, os.path.getsize(user_data_path))
+        return
+    (fd, temp_path) = tempfile.mkstemp(
+        dir=os.path.dirname(user_data_path) or '.',
+        prefix='.{}.'.format(os.path.basename(user_data_path)),
+    )
+    os.close(fd)
+    # Every record is rewritten, so the index is rebuilt from scratch
+    index_builder = OffsetIndexBuilder() if offset_index else None
+    user_dicts = chain(iter_json_records_from_file(user_data_path), user_dicts)
+    try:
+        write_json_array_to_file(
+            index_builder.track(user_dicts) if index_builder else user_dicts,
+            temp_path,
+            compression=compression,
+            record_offsets=index_builder.offsets if index_builder else None,
+        )
+        # mkstemp creates files that only the owner can read
+        shutil.copymode(user_data_path, temp_path)
+        os.replace(temp_path, user_data_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    if index_builder:
+        index_builder.write(index_path, os.path.getsize(user_data_path))
@@ -0,0 +1,87 @@
+import random
+from datetime import date
+
+from randomuser_client import (
+    create_param_groups,
+    determine_user_count_per_group,
+)
+import settings
+from settings import (
+    USERS_TO_GENERATE,
+    LOCAL_USER_DOB_RANGE,
+)
+
+LOCAL_SOURCE_NAME = 'local'
+EMAIL_DOMAIN = 'example.com'
+# Emails end in a random number below this, since there are only a few thousand name combinations per nationality
+EMAIL_NUMBER_LIMIT = 1000000
+
+
+class LocalUserPool:
+    """Pre-built tuples of values that local users are drawn from for a single nationality"""
+    def __init__(self, nat):
+        names = settings.LOCAL_USER_NAMES[nat]
+        self.nat = nat
+        self.first_names = {
+            'female': tuple(names['female']),
+            'male': tuple(names['male']),
+        }
+        self.last_names = tuple(names['last'])
+        self.cities = tuple(names['city'])
+        self.state_sampler = settings.STATE_CODE_SAMPLERS[nat]
+        self.min_dob_ordinal = LOCAL_USER_DOB_RANGE[0].toordinal()
+        self.max_dob_ordinal = LOCAL_USER_DOB_RANGE[1].toordinal()
+
+
+def parse_param_group(api_param_group):
+    """Turns a group of querystring params (eg: ('nat=us', 'gender=female')) into a dict"""
+    return dict(param.split('=', 1) for param in api_param_group)
+
+
+def create_local_user(rng, pool, gender):
+    """Creates a single raw user record in the same shape as a randomuser.me result"""
+    first = rng.choice(pool.first_names[gender])
+    last = rng.choice(pool.last_names)
+    dob = date.fromordinal(rng.randint(pool.min_dob_ordinal, pool.max_dob_ordinal))
+    city = rng.choice(pool.cities)
+    state = pool.state_sampler.draw(rng)
+    email_number = int(rng.random() * EMAIL_NUMBER_LIMIT)
+    return {
+        'gender': gender,
+        'name': {'first': first, 'last': last},
+        'location': {
+            'city': city,
+            'state': state,
+        },
+        'email': '{}.{}{}@{}'.format(first, last, email_number, EMAIL_DOMAIN),
+        'dob': '{} 00:00:00'.format(dob.isoformat()),
+        'nat': pool.nat,
+    }
+
+
+def local_user_iter(user_count_per_group, seed):
+    """
+    Yields raw user records for every group of params in the same order that randomuser.me
+    results are returned. The same seed always produces the same records.
+    """
+    rng = random.Random(seed)
+    pools = {}
+    for api_param_group in create_param_groups():
+        params = parse_param_group(api_param_group)
+        nat = params['nat'].upper()
+        if nat not in pools:
+            pools[nat] = LocalUserPool(nat)
+        pool = pools[nat]
+        gender = params['gender']
+        for _ in range(user_count_per_group):
+            yield create_local_user(rng, pool, gender)
+
+
+def get_all_local_user_results(seed=None, user_count=USERS_TO_GENERATE):
+    """Generates raw user records locally instead of querying randomuser.me"""
+    if seed is None:
+        seed = '{:016x}'.format(random.getrandbits(64))
+    user_count_per_group = determine_user_count_per_group(user_count)
+    user_results = list(local_user_iter(user_count_per_group, seed))
+    generation_metadata = [{'source': LOCAL_SOURCE_NAME, 'seed': seed}]
+    return user_results, generation_metadata
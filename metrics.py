@@ -0,0 +1,140 @@
+import os
+import sys
+import time
+import resource
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+FETCH_STAGE = 'fetch'
+# First pass of a streaming run, which indexes raw results and plans edits/enrollments for every user
+INDEX_STAGE = 'index'
+PARSE_STAGE = 'parse'
+DEDUPE_STAGE = 'dedupe'
+EDIT_STAGE = 'edit'
+EDX_STAGE = 'edx'
+WRITE_STAGE = 'write'
+# Second pass of a streaming run, which creates, edits and writes users one shard at a time
+STREAM_STAGE = 'stream'
+# Per-user run, which creates and writes each user independently of the others
+PER_USER_STAGE = 'per_user'
+STAGES = [
+    FETCH_STAGE,
+    INDEX_STAGE,
+    PARSE_STAGE,
+    DEDUPE_STAGE,
+    EDIT_STAGE,
+    EDX_STAGE,
+    WRITE_STAGE,
+    STREAM_STAGE,
+    PER_USER_STAGE,
+]
+
+
+def cpu_seconds():
+    """CPU time used by this process and any worker processes that have finished"""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def peak_rss_bytes():
+    """Largest peak RSS of this process and any worker processes that have finished"""
+    max_rss = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # ru_maxrss is in bytes on macOS, and kilobytes elsewhere
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class StageMetrics:
+    __slots__ = ('wall_seconds', 'cpu_seconds', 'count')
+
+    def __init__(self):
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.count = None
+
+    def to_dict(self):
+        return {
+            'wall_seconds': self.wall_seconds,
+            'cpu_seconds': self.cpu_seconds,
+            'count': self.count,
+            'records_per_second': self.count / self.wall_seconds if self.count and self.wall_seconds else None,
+        }
+
+
+class GenerationMetrics:
+    """
+    Records wall time, CPU time and record counts for each stage of a generation run. If a profile stage
+    is given, that stage is also run under cProfile and tracemalloc and the results are dumped to files.
+    """
+    def __init__(self, profile_stage=None, profile_path_prefix=None):
+        self.profile_stage = profile_stage
+        self.profile_path_prefix = profile_path_prefix
+        self.stages = {}
+        self.start_wall_seconds = time.perf_counter()
+        self.start_cpu_seconds = cpu_seconds()
+
+    @contextmanager
+    def stage(self, stage_name):
+        stage_metrics = self.stages.setdefault(stage_name, StageMetrics())
+        profiling = stage_name == self.profile_stage
+        if profiling:
+            # The profiling modules are only imported when a stage is actually profiled
+            import cProfile
+            profiler = cProfile.Profile()
+            tracemalloc.start()
+            profiler.enable()
+        start_wall_seconds = time.perf_counter()
+        start_cpu_seconds = cpu_seconds()
+        try:
+            yield
+        finally:
+            stage_metrics.wall_seconds += time.perf_counter() - start_wall_seconds
+            stage_metrics.cpu_seconds += cpu_seconds() - start_cpu_seconds
+            if profiling:
+                profiler.disable()
+                self.dump_profile(stage_name, profiler, tracemalloc.take_snapshot())
+                tracemalloc.stop()
+
+    def count(self, stage_name, count):
+        self.stages.setdefault(stage_name, StageMetrics()).count = count
+
+    def dump_profile(self, stage_name, profiler, snapshot):
+        import pstats
+        path_prefix = '{}_{}'.format(self.profile_path_prefix, stage_name)
+        profiler.dump_stats('{}.prof'.format(path_prefix))
+        snapshot.dump('{}.tracemalloc'.format(path_prefix))
+        with open('{}.txt'.format(path_prefix), 'w') as f:
+            pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(50)
+            f.write('\nTop memory allocations:\n')
+            for stat in snapshot.statistics('lineno')[:25]:
+                f.write('{}\n'.format(stat))
+
+    def to_dict(self):
+        total_wall_seconds = time.perf_counter() - self.start_wall_seconds
+        user_count = next(
+            (self.stages[stage_name].count for stage_name in reversed(STAGES)
+             if stage_name in self.stages and self.stages[stage_name].count),
+            None
+        )
+        return {
+            'wall_seconds': total_wall_seconds,
+            'cpu_seconds': cpu_seconds() - self.start_cpu_seconds,
+            'peak_rss_bytes': peak_rss_bytes(),
+            'records_per_second': user_count / total_wall_seconds if user_count else None,
+            'profile_stage': self.profile_stage,
+            'stages': {stage_name: stage_metrics.to_dict() for stage_name, stage_metrics in self.stages.items()},
+        }
+
+
+class NullMetrics:
+    """Stands in for GenerationMetrics when metrics are turned off, so recording them costs next to nothing"""
+    def stage(self, stage_name):
+        return nullcontext()
+
+    def count(self, stage_name, count):
+        pass
+
+
+NULL_METRICS = NullMetrics()
@@ -0,0 +1,215 @@
+import os
+import sys
+import json
+import mmap
+import struct
+from array import array
+
+from dedupe import email_hash
+
+OFFSET_INDEX_SUFFIX = '.idx'
+OFFSET_INDEX_MAGIC = b'RMUIDX02'
+# Magic, record count, email bucket count and the size of the data file the index was written for
+OFFSET_INDEX_HEADER = struct.Struct('<8sQQQ')
+# Average number of emails in each email bucket
+EMAIL_BUCKET_LOAD = 2
+
+
+def offset_index_path(user_data_path):
+    return user_data_path + OFFSET_INDEX_SUFFIX
+
+
+def write_u64_array(f, values):
+    # Index files are always little-endian
+    if sys.byteorder != 'little':
+        values = array('Q', values)
+        values.byteswap()
+    values.tofile(f)
+
+
+def read_u64_array(buf, start, count):
+    """Gets count 64-bit values from a buffer without copying them (except on big-endian machines)"""
+    values = buf[start:start + 8 * count]
+    if sys.byteorder == 'little':
+        return values.cast('Q')
+    swapped_values = array('Q')
+    swapped_values.frombytes(values)
+    swapped_values.byteswap()
+    return swapped_values
+
+
+def build_email_buckets(email_hashes, bucket_count):
+    """
+    Groups record indices by email hash, so every record with a given email is in the same bucket. Returns the
+    start of each bucket (plus the end of the last one), and the email hashes and record indices in bucket order.
+    """
+    bucket_sizes = array('Q', bytes(8 * bucket_count))
+    for key_hash in email_hashes:
+        bucket_sizes[key_hash % bucket_count] += 1
+    bucket_starts = array('Q', [0])
+    for bucket_size in bucket_sizes:
+        bucket_starts.append(bucket_starts[-1] + bucket_size)
+    next_positions = array('Q', bucket_starts[:-1])
+    bucket_hashes = array('Q', bytes(8 * len(email_hashes)))
+    bucket_records = array('Q', bytes(8 * len(email_hashes)))
+    for record_index, key_hash in enumerate(email_hashes):
+        bucket = key_hash % bucket_count
+        position = next_positions[bucket]
+        bucket_hashes[position] = key_hash
+        bucket_records[position] = record_index
+        next_positions[bucket] = position + 1
+    return bucket_starts, bucket_hashes, bucket_records
+
+
+class OffsetIndexBuilder:
+    """
+    Collects the byte offsets and email hashes of user records as they're written (see track and the
+    record_offsets param of the JSON writers in utils), and writes them to an offset index file:
+
+        header          magic, record count, email bucket count and data file size (OFFSET_INDEX_HEADER)
+        record offsets  record count + 1 offsets. Record k is in bytes [offsets[k], offsets[k + 1]) of the
+                        data file, possibly followed by separators.
+        email buckets   (if the bucket count isn't 0) bucket count + 1 bucket starts, then the email hashes
+                        and record indices of every record, grouped by bucket (email hash % bucket count)
+
+    All values are little-endian unsigned 64-bit integers.
+    """
+    def __init__(self, email_buckets=True):
+        self.offsets = array('Q')
+        self.email_hashes = array('Q') if email_buckets else None
+
+    @classmethod
+    def from_index_file(cls, user_data_path, index_path=None):
+        """
+        Starts from the records in an existing index, so offsets of records appended to its data file can
+        be added. The end offset of the last record is left off, since it's where the next record starts.
+        """
+        with OffsetIndexReader(user_data_path, index_path) as index:
+            builder = cls(email_buckets=index.bucket_count > 0)
+            builder.offsets.extend(index.offsets[:-1])
+            if builder.email_hashes is not None:
+                builder.email_hashes.extend(index.record_email_hashes())
+        return builder
+
+    def track(self, user_dicts):
+        """Passes serialized users through, keeping the hash of each user's email"""
+        for user_dict in user_dicts:
+            if self.email_hashes is not None:
+                self.email_hashes.append(email_hash(user_dict['email']))
+            yield user_dict
+
+    def write(self, index_path, data_size):
+        """Writes the index for a data file of data_size bytes, which readers check the file against"""
+        record_count = len(self.offsets) - 1
+        if self.email_hashes is None:
+            bucket_count = 0
+        else:
+            bucket_count = max(1, record_count // EMAIL_BUCKET_LOAD)
+        temp_path = '{}.tmp'.format(index_path)
+        with open(temp_path, 'wb') as f:
+            f.write(OFFSET_INDEX_HEADER.pack(OFFSET_INDEX_MAGIC, record_count, bucket_count, data_size))
+            write_u64_array(f, self.offsets)
+            if bucket_count:
+                for values in build_email_buckets(self.email_hashes, bucket_count):
+                    write_u64_array(f, values)
+        os.replace(temp_path, index_path)
+
+
+class OffsetIndexReader:
+    """
+    Random access to the records of an uncompressed user data file (JSON array or JSON Lines) through its
+    offset index. Both files are memory-mapped, and only the records that are asked for are read and decoded.
+    Readers can be opened by any number of processes to read different slices of the same file.
+    """
+    def __init__(self, user_data_path, index_path=None):
+        self.index_file = open(index_path or offset_index_path(user_data_path), 'rb')
+        self.index_map = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.index_buf = memoryview(self.index_map)
+        (magic, self.record_count, self.bucket_count, data_size) = OFFSET_INDEX_HEADER.unpack_from(self.index_buf)
+        self.data_file = None
+        if magic != OFFSET_INDEX_MAGIC:
+            self.close()
+            raise ValueError('Not an offset index file: {}'.format(self.index_file.name))
+        position = OFFSET_INDEX_HEADER.size
+        self.offsets = read_u64_array(self.index_buf, position, self.record_count + 1)
+        position += 8 * (self.record_count + 1)
+        if self.bucket_count:
+            self.bucket_starts = read_u64_array(self.index_buf, position, self.bucket_count + 1)
+            position += 8 * (self.bucket_count + 1)
+            self.bucket_hashes = read_u64_array(self.index_buf, position, self.record_count)
+            position += 8 * self.record_count
+            self.bucket_records = read_u64_array(self.index_buf, position, self.record_count)
+        self.data_file = open(user_data_path, 'rb')
+        self.data_map = b''
+        if os.fstat(self.data_file.fileno()).st_size != data_size:
+            self.close()
+            raise ValueError('Offset index {} was written for a different version of {}'.format(
+                self.index_file.name, user_data_path
+            ))
+        if data_size:
+            self.data_map = mmap.mmap(self.data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.decoder = json.JSONDecoder()
+
+    def __len__(self):
+        return self.record_count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        # Views of a memory map have to be released before it can be closed
+        for name in ('offsets', 'bucket_starts', 'bucket_hashes', 'bucket_records', 'index_buf'):
+            view = self.__dict__.pop(name, None)
+            if isinstance(view, memoryview):
+                view.release()
+        self.index_map.close()
+        self.index_file.close()
+        if self.data_file is not None:
+            if isinstance(self.data_map, mmap.mmap):
+                self.data_map.close()
+            self.data_file.close()
+
+    def record_text(self, k):
+        return self.data_map[self.offsets[k]:self.offsets[k + 1]].decode('utf-8')
+
+    def get(self, k):
+        """Decodes user record k. Negative indices count from the end, as with a list."""
+        if k < 0:
+            k += self.record_count
+        if not 0 <= k < self.record_count:
+            raise IndexError('User record index out of range: {}'.format(k))
+        # A record can be followed by separators (eg: ',' in a JSON array), which raw_decode ignores
+        return self.decoder.raw_decode(self.record_text(k))[0]
+
+    def iter_slice(self, start, stop):
+        """Lazily decodes records in a range of indices (with the same bounds handling as a list slice)"""
+        for k in range(*slice(start, stop).indices(self.record_count)):
+            yield self.decoder.raw_decode(self.record_text(k))[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.get(k) for k in range(*key.indices(self.record_count))]
+        return self.get(key)
+
+    def record_email_hashes(self):
+        """Gets the email hash of every record, in record order"""
+        email_hashes = array('Q', bytes(8 * self.record_count))
+        for key_hash, record_index in zip(self.bucket_hashes, self.bucket_records):
+            email_hashes[record_index] = key_hash
+        return email_hashes
+
+    def find_by_email(self, email):
+        """Gets the user record with an email, or None if there isn't one"""
+        if not self.bucket_count:
+            raise ValueError('This offset index was written without email buckets')
+        key_hash = email_hash(email)
+        bucket = key_hash % self.bucket_count
+        for position in range(self.bucket_starts[bucket], self.bucket_starts[bucket + 1]):
+            if self.bucket_hashes[position] == key_hash:
+                user_dict = self.get(self.bucket_records[position])
+                if user_dict['email'] == email:
+                    return user_dict
+        return None
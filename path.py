@@ -9,6 +9,15 @@ RESULT_PROGRAM_DATA_PATH = os.path.join(RESULT_DIR, 'realistic_program_data.json
 USER_DATA_PATH = os.path.join(RESULT_DIR, 'realistic_user_data.json')
 API_RESULT_DATA_PATH = os.path.join(RESULT_DIR, 'randomuser_results.json')
 API_METADATA_PATH = os.path.join(RESULT_DIR, 'randomuser_results_metadata.json')
+LOCAL_RESULT_DATA_PATH = os.path.join(RESULT_DIR, 'localuser_results.json')
+LOCAL_METADATA_PATH = os.path.join(RESULT_DIR, 'localuser_results_metadata.json')
+RELATIONAL_CSV_DIR = os.path.join(RESULT_DIR, 'relational_csv')
+SQLITE_DB_PATH = os.path.join(RESULT_DIR, 'realistic_data.sqlite3')
+COLUMNAR_DIR = os.path.join(RESULT_DIR, 'columnar')
+GENERATION_METRICS_PATH = os.path.join(RESULT_DIR, 'generation_metrics.json')
+GENERATION_PROFILE_PATH_PREFIX = os.path.join(RESULT_DIR, 'generation_profile')
+API_CACHE_DIR = os.path.join(RESULT_DIR, 'api_cache')
+BENCHMARK_RESULTS_PATH = os.path.join(RESULT_DIR, 'benchmark_results.json')
 
 SETTINGS_DIR_NAME = 'settings'
 SETTINGS_DIR = os.path.join(PACKAGE_DIR, SETTINGS_DIR_NAME)
@@ -16,3 +25,6 @@ FIELDS_OF_STUDY_PATH = os.path.join(SETTINGS_DIR, 'fields_of_study.json')
 US_STATE_CODE_MAP = os.path.join(SETTINGS_DIR, 'us_states.json')
 CANADA_STATE_CODE_MAP = os.path.join(SETTINGS_DIR, 'canada_states.json')
 SPAIN_STATE_CODE_MAP = os.path.join(SETTINGS_DIR, 'spain_states.json')
+LOCAL_USER_NAMES_PATH = os.path.join(SETTINGS_DIR, 'local_user_names.json')
+# Pickled copy of the settings that are loaded from JSON (see settings.load_cached_data_settings)
+SETTINGS_CACHE_PATH = os.path.join(SETTINGS_DIR, '.data_settings_cache.pickle')
@@ -0,0 +1,208 @@
+from array import array
+from collections import defaultdict
+from itertools import chain
+from multiprocessing import Pool
+
+import settings
+from counter_rng import counter_rng
+from sampling import Sampler
+from utils import get_random_range_from_iterable
+from randomuser_client import (
+    create_param_groups,
+    determine_user_count_per_group,
+    parse_randomuser_location,
+    count_worker_state_lookup_misses,
+    add_worker_state_lookup_misses,
+)
+from localuser_client import LocalUserPool, parse_param_group, create_local_user
+from date_tables import UserDateTable
+from api import (
+    NOW,
+    GRADE_VALUES,
+    ProgramEdxTemplates,
+    create_user_from_result,
+    cross_program_cohort_courses,
+)
+from dedupe import indexed_email
+from settings import (
+    USERS_TO_GENERATE,
+    PCT_USERS_MOVED,
+    PCT_USERS_ENROLLED,
+    CROSS_PROGRAM_EDX_COHORTS,
+    PROGRAM_EDX_COHORTS,
+)
+
+# Number of users created by each task when users are created with a process pool
+PER_USER_CHUNK_SIZE = 1000
+NOT_ENROLLED = 'not_enrolled'
+PROGRAM_COHORT = 'program'
+
+
+class LocalResultSource:
+    """
+    Raw local user results (see localuser_client) for a seed and user count, in the same groups as
+    local_user_iter. Each result is created from its own random stream when it's looked up, so any one of them
+    can be created without creating the others.
+    """
+    def __init__(self, seed, user_count=USERS_TO_GENERATE):
+        self.seed = seed
+        self.user_count_per_group = determine_user_count_per_group(user_count)
+        pools = {}
+        self.groups = []
+        country_ranges = defaultdict(list)
+        for group_index, api_param_group in enumerate(create_param_groups()):
+            params = parse_param_group(api_param_group)
+            nat = params['nat'].upper()
+            if nat not in pools:
+                pools[nat] = LocalUserPool(nat)
+            self.groups.append((pools[nat], params['gender']))
+            group_start = group_index * self.user_count_per_group
+            country_ranges[nat].append(range(group_start, group_start + self.user_count_per_group))
+        # Groups of the same nationality are next to each other, so this is usually a single range
+        self.country_user_indices = {
+            nat: ranges[0] if len(ranges) == 1 else array('I', chain(*ranges))
+            for nat, ranges in country_ranges.items()
+        }
+
+    def __len__(self):
+        return self.user_count_per_group * len(self.groups)
+
+    def __getitem__(self, i):
+        (pool, gender) = self.groups[i // self.user_count_per_group]
+        return create_local_user(counter_rng(self.seed, i, 'raw'), pool, gender)
+
+
+def index_result_countries(user_results):
+    """Groups the indices of raw results by nationality"""
+    country_user_indices = defaultdict(lambda: array('I'))
+    for i, user_result in enumerate(user_results):
+        country_user_indices[user_result['nat']].append(i)
+    return dict(country_user_indices)
+
+
+class PerUserGenerator:
+    """
+    Creates any user of a set of raw results on its own. Every random draw for a user comes from a counter-based
+    random stream keyed by the master seed, the user's index and a field ('profile', 'location', 'edx' or
+    'grades'), so a user is the same no matter which other users are created, or in what order.
+
+    The distributions match a normal run, but each user draws their own outcome instead of being dealt one from
+    a shuffled list: about PCT_USERS_MOVED of users are moved to the location of a random user in another
+    country, and enrolled users pick a cohort (see CROSS_PROGRAM_EDX_COHORTS and PROGRAM_EDX_COHORTS) with
+    probability in proportion to its share of users. Emails are made unique with the user's index as a '+N' suffix.
+    """
+    def __init__(self, seed, user_results, all_program_data, country_user_indices=None,
+                 cross_program_cohorts=CROSS_PROGRAM_EDX_COHORTS, program_cohorts=PROGRAM_EDX_COHORTS):
+        self.seed = seed
+        self.user_results = user_results
+        if country_user_indices is None:
+            country_user_indices = index_result_countries(user_results)
+        self.country_user_indices = country_user_indices
+        self.other_countries = {
+            country: [k for k in settings.COUNTRY_STATE_CODE_MAP.keys() if k != country and k in country_user_indices]
+            for country in country_user_indices
+        }
+        self.program_templates = [ProgramEdxTemplates(program_data) for program_data in all_program_data]
+        # Date values only depend on a user's DOB, so they're shared by every user created here
+        self.date_table = UserDateTable(NOW)
+
+        # First pick between each cross-program cohort, a single program cohort, or no enrollments at all...
+        cross_program_pct = sum(cohort['pct'] for cohort in cross_program_cohorts)
+        enrolled_weights = [PCT_USERS_ENROLLED * cohort['pct'] for cohort in cross_program_cohorts]
+        enrolled_weights.append(PCT_USERS_ENROLLED * (1 - cross_program_pct))
+        self.cohort_type_sampler = Sampler(
+            list(cross_program_cohorts) + [PROGRAM_COHORT, NOT_ENROLLED],
+            enrolled_weights + [max(0.0, 1 - sum(enrolled_weights))],
+        )
+        # ...then, for a program cohort, pick between the cohorts within the program
+        assigned_pct = sum(cohort['pct'] for cohort in program_cohorts if cohort['pct'] is not None)
+        program_cohort_weights = [
+            cohort['pct'] if cohort['pct'] is not None else max(0.0, 1 - assigned_pct)
+            for cohort in program_cohorts
+        ]
+        self.program_cohort_sampler = Sampler(
+            list(program_cohorts) + [NOT_ENROLLED],
+            program_cohort_weights + [max(0.0, 1 - sum(program_cohort_weights))],
+        )
+
+    def __len__(self):
+        return len(self.user_results)
+
+    def user_location(self, i):
+        return parse_randomuser_location(self.user_results[i], record_misses=False)
+
+    def move_user(self, user, i):
+        """Moves some users to a location in a different country than their nationality"""
+        rng = counter_rng(self.seed, i, 'location')
+        other_countries = self.other_countries[user.country]
+        if rng.random() >= PCT_USERS_MOVED or not other_countries:
+            return
+        new_country = rng.choice(other_countries)
+        location_user_index = rng.choice(self.country_user_indices[new_country])
+        (user.country, user.state_or_territory, user.city) = self.user_location(location_user_index)
+
+    def draw_cohort_courses(self, rng):
+        """Picks the enrollments and graded course keys of a user's cohort, or None if they aren't enrolled"""
+        if not self.program_templates:
+            return None
+        cohort = self.cohort_type_sampler.draw(rng)
+        if cohort == NOT_ENROLLED:
+            return None
+        if cohort == PROGRAM_COHORT:
+            templates = rng.choice(self.program_templates)
+            cohort = self.program_cohort_sampler.draw(rng)
+            if cohort == NOT_ENROLLED:
+                return None
+            return templates.enrollments[:cohort['enrollments']], templates.course_keys[:cohort['grades']]
+        program_index_range = get_random_range_from_iterable(
+            self.program_templates, min(cohort['programs'], len(self.program_templates)), rng=rng
+        )
+        return cross_program_cohort_courses(self.program_templates[slice(*program_index_range)], cohort)
+
+    def enroll_user(self, user, i):
+        cohort_courses = self.draw_cohort_courses(counter_rng(self.seed, i, 'edx'))
+        if cohort_courses is None:
+            return
+        (enrollments, graded_course_keys) = cohort_courses
+        grades = counter_rng(self.seed, i, 'grades').choices(GRADE_VALUES, k=len(graded_course_keys))
+        user.enrollments = enrollments
+        user.grades = list(zip(graded_course_keys, grades))
+
+    def create_user(self, i):
+        user_result = self.user_results[i]
+        self.date_table.add_randomuser_dobs([user_result['dob']])
+        user = create_user_from_result(
+            user_result, rng=counter_rng(self.seed, i, 'profile'), date_table=self.date_table
+        )
+        user.email = indexed_email(user.email, i)
+        self.move_user(user, i)
+        self.enroll_user(user, i)
+        return user
+
+
+# Generator used by each worker process (see iter_per_user_users)
+WORKER_GENERATOR = None
+
+
+def set_worker_generator(generator):
+    global WORKER_GENERATOR
+    WORKER_GENERATOR = generator
+
+
+def create_worker_users(index_range):
+    return count_worker_state_lookup_misses(lambda: [WORKER_GENERATOR.create_user(i) for i in index_range])
+
+
+def iter_per_user_users(generator, user_range=slice(None), workers=1, chunk_size=PER_USER_CHUNK_SIZE):
+    """
+    Creates the users in a slice of a PerUserGenerator's indices, in order. With more than one worker, chunks of
+    indices are handed to a process pool, and the users are the same as with one.
+    """
+    user_indices = range(*user_range.indices(len(generator)))
+    if workers <= 1:
+        yield from map(generator.create_user, user_indices)
+        return
+    index_ranges = [user_indices[start:start + chunk_size] for start in range(0, len(user_indices), chunk_size)]
+    with Pool(workers, initializer=set_worker_generator, initargs=(generator,)) as pool:
+        for users in add_worker_state_lookup_misses(pool.imap(create_worker_users, index_ranges)):
+            yield from users
@@ -1,22 +1,40 @@
-import requests
+import random
+from collections import Counter
+from math import ceil
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+import settings
+from api_cache import (
+    load_cached_response,
+    save_cached_response,
+)
+from records import UserRecord
 from utils import (
     date_from_randomuser_dob,
+    derive_rng,
     increment_year,
     year_diff,
-    case_insensitive_lookup,
+    normalize_lookup_key,
     random_item_from_iterable,
     list_product
 )
 from settings import (
     USERS_TO_GENERATE,
-    COUNTRY_STATE_CODE_MAP,
     GRAD_AGES,
     MIN_AGE,
 )
 
 
 RANDOMUSER_URL='https://randomuser.me/api/'
+# randomuser.me caps the number of results per request at 5000
+API_RESULTS_PER_PAGE = 1000
+API_CONCURRENCY = 4
+API_RETRIES = 5
+API_BACKOFF_FACTOR = 0.5
+API_RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+API_TIMEOUT = 30
 USER_GROUP_PARAMS = {
     'nat': ['us', 'ca', 'es'],
     'gender': ['female', 'male']
@@ -25,6 +43,8 @@ USER_GROUP_SORTING = {
     'nat': 0,
     'gender': 1
 }
+# Number of users per country whose state couldn't be found and fell back to the default state
+STATE_LOOKUP_MISSES = Counter()
 PREFERRED_LANG_MAP = {
     'nat=us': 'en',
     'nat=ca': 'en',
@@ -32,10 +52,10 @@ PREFERRED_LANG_MAP = {
 }
 
 
-def determine_user_count_per_group():
+def determine_user_count_per_group(user_count=USERS_TO_GENERATE):
     """Calculates the number of users that should be generated for each group"""
     return int(
-        USERS_TO_GENERATE/
+        user_count/
         len(list_product(USER_GROUP_PARAMS.values()))
     )
 
@@ -50,12 +70,81 @@ def create_param_groups():
     return list_product(querystrung_group_params)
 
 
-def api_param_iter(user_count_per_group):
-    results_count_param = 'results={}'.format(user_count_per_group)
+def create_group_seed(rng=random):
+    return '{:016x}'.format(rng.getrandbits(64))
+
+
+def create_group_seeds(seed):
+    """Derives a randomuser.me seed for each group of params from a master seed"""
+    return {
+        '&'.join(api_param_group): create_group_seed(derive_rng(seed, 'api', '&'.join(api_param_group)))
+        for api_param_group in create_param_groups()
+    }
+
+
+def api_page_iter(user_count_per_group, results_per_page=API_RESULTS_PER_PAGE, group_seeds=None):
+    """
+    Splits each group of params into pages of results_per_page users. Pages in a group share a seed so
+    randomuser.me returns one consistent result set for that group. Yields (params, count) tuples in the same
+    group order as create_param_groups, where count is the number of results to keep from the page.
+
+    Every page asks for exactly results_per_page results (even if fewer are kept), so a page's url (and its
+    cache entry) doesn't depend on the user count, and growing a group with the same seed only adds new pages.
+    """
+    if user_count_per_group <= 0:
+        return
+    group_seeds = group_seeds or {}
+    page_count = ceil(user_count_per_group / results_per_page)
     for api_param_group in create_param_groups():
-        # nationality_param = filter(lambda param: 'nat=' in param, api_param_group)[0]
-        # preferred_lang_param = PREFERRED_LANG_MAP[nationality_param]
-        yield '&'.join(api_param_group + (results_count_param, ))
+        group_seed = group_seeds.get('&'.join(api_param_group)) or create_group_seed()
+        seed_param = 'seed={}'.format(group_seed)
+        for page in range(1, page_count + 1):
+            count = min(results_per_page, user_count_per_group - (page - 1) * results_per_page)
+            page_params = ('results={}'.format(results_per_page), 'page={}'.format(page), seed_param)
+            yield '&'.join(api_param_group + page_params), count
+
+
+def create_api_session(pool_size=API_CONCURRENCY, retries=API_RETRIES, backoff_factor=API_BACKOFF_FACTOR):
+    """Creates a session with a keep-alive connection pool that retries failed calls with backoff"""
+    # requests is slow to import and isn't needed unless something is actually fetched
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=API_RETRY_STATUS_CODES,
+        allowed_methods=frozenset(['GET']),
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def fetch_api_page(session, api_url):
+    resp = session.get(api_url, timeout=API_TIMEOUT)
+    resp.raise_for_status()
+    return resp.json()
+
+
+def count_worker_state_lookup_misses(create):
+    """
+    Calls create() in a pool worker process, returning its result along with the state lookup misses it
+    recorded. A worker's STATE_LOOKUP_MISSES isn't seen by the parent process, which adds the misses to its own
+    (see add_worker_state_lookup_misses). Misses that a forked worker inherited from its parent are left out.
+    """
+    STATE_LOOKUP_MISSES.clear()
+    return create(), Counter(STATE_LOOKUP_MISSES)
+
+
+def add_worker_state_lookup_misses(worker_results):
+    """Yields the results of count_worker_state_lookup_misses, adding the misses to STATE_LOOKUP_MISSES"""
+    for result, state_lookup_misses in worker_results:
+        STATE_LOOKUP_MISSES.update(state_lookup_misses)
+        yield result
 
 
 def parse_gender(gender_value):
@@ -65,38 +154,87 @@ def parse_gender(gender_value):
     )[gender_value]
 
 
-def parse_randomuser_data(user, now=None):
-    # TODO: profile pictures
-    now = now or datetime.now()
-    dob = date_from_randomuser_dob(user['dob'])
-    if year_diff(dob, now) < MIN_AGE:
-        # Coerce < 18 y/o users to be older. Randomly assign 18, 22, or 30 years old
-        dob = increment_year(now, random_item_from_iterable([age * -1 for age in GRAD_AGES])).date()
-    state_code_dict = COUNTRY_STATE_CODE_MAP[user['nat']]
-    state_code = case_insensitive_lookup(state_code_dict, user['location']['state'])
+def parse_randomuser_location(user, record_misses=True):
+    """Gets the (country, state_or_territory, city) of a randomuser.me result"""
+    state_code = settings.COUNTRY_STATE_LOOKUP_MAP[user['nat']].get(normalize_lookup_key(user['location']['state']))
     if not state_code:
-        state_code = list(state_code_dict.values())[0]
-    return {
-        'first_name': user['name']['first'].title(),
-        'last_name': user['name']['last'].title(),
-        'date_of_birth': dob.isoformat(),
-        'gender': parse_gender(user['gender']),
-        'country': user['nat'],
-        'state_or_territory': u'{}-{}'.format(user['nat'], state_code),
-        'city': user['location']['city'].title(),
-        'email': user['email']
-    }
+        if record_misses:
+            STATE_LOOKUP_MISSES[user['nat']] += 1
+        state_code = settings.DEFAULT_STATE_CODE_MAP[user['nat']]
+    return user['nat'], u'{}-{}'.format(user['nat'], state_code), user['location']['city'].title()
 
 
-def get_all_user_api_results():
-    user_count_per_group = determine_user_count_per_group()
-    param_groups = api_param_iter(user_count_per_group)
+def parse_randomuser_data(user, now=None, rng=random, date_table=None):
+    # TODO: profile pictures
+    if date_table is not None:
+        dob = date_table.parse_randomuser_dob(user['dob'], rng=rng)
+    else:
+        now = now or datetime.now()
+        dob = date_from_randomuser_dob(user['dob'])
+        if year_diff(dob, now) < MIN_AGE:
+            # Coerce < 18 y/o users to be older. Randomly assign 18, 22, or 30 years old
+            dob = increment_year(now, random_item_from_iterable([age * -1 for age in GRAD_AGES], rng=rng)).date()
+    (country, state_or_territory, city) = parse_randomuser_location(user)
+    return UserRecord(
+        first_name=user['name']['first'].title(),
+        last_name=user['name']['last'].title(),
+        date_of_birth=dob,
+        gender=parse_gender(user['gender']),
+        country=country,
+        state_or_territory=state_or_territory,
+        city=city,
+        email=user['email'],
+    )
+
+
+def fetch_api_pages(api_pages, concurrency=API_CONCURRENCY, use_cache=True):
+    """
+    Fetches (url, count) pages of randomuser.me results on a thread pool, keeping the first count results
+    of each page (or all of them if count is None). Pages that are in the on-disk cache aren't requested
+    again, and results are returned in the same order as the pages regardless of when responses arrive.
+    """
+    resp_jsons = [load_cached_response(api_url) if use_cache else None for api_url, _ in api_pages]
+    missing_indices = [i for i, resp_json in enumerate(resp_jsons) if resp_json is None]
+    if missing_indices:
+        with create_api_session(pool_size=concurrency) as session, \
+                ThreadPoolExecutor(max_workers=concurrency) as executor:
+            fetched_jsons = executor.map(lambda i: fetch_api_page(session, api_pages[i][0]), missing_indices)
+            for i, resp_json in zip(missing_indices, fetched_jsons):
+                if use_cache:
+                    save_cached_response(api_pages[i][0], resp_json)
+                resp_jsons[i] = resp_json
+
     api_call_metadata = []
     user_results = []
-    for params in param_groups:
-        api_url = '{}?{}'.format(RANDOMUSER_URL, params)
-        resp = requests.get(api_url)
-        resp_json = resp.json()
-        api_call_metadata.append({'url': api_url, 'seed': resp_json['info']['seed']})
-        user_results += resp_json['results']
+    for (api_url, count), resp_json in zip(api_pages, resp_jsons):
+        api_call_metadata.append({'url': api_url, 'seed': resp_json['info']['seed'], 'count': count})
+        user_results += resp_json['results'][:count]
     return user_results, api_call_metadata
+
+
+def get_all_user_api_results(base_url=RANDOMUSER_URL, concurrency=API_CONCURRENCY, seed=None, use_cache=True,
+                             user_count=USERS_TO_GENERATE):
+    """
+    Fetches all pages of randomuser.me results. If a master seed is given, each group's randomuser.me seed
+    is derived from it, so re-running with the same seed only fetches pages that aren't cached yet.
+    """
+    user_count_per_group = determine_user_count_per_group(user_count)
+    group_seeds = create_group_seeds(seed) if seed is not None else None
+    api_pages = [
+        ('{}?{}'.format(base_url, params), count)
+        for params, count in api_page_iter(user_count_per_group, group_seeds=group_seeds)
+    ]
+    return fetch_api_pages(api_pages, concurrency=concurrency, use_cache=use_cache)
+
+
+def get_api_results_from_metadata(api_call_metadata, concurrency=API_CONCURRENCY, use_cache=True):
+    """Rebuilds a set of randomuser.me results from the urls and seeds recorded in saved metadata"""
+    api_pages = []
+    for call_metadata in api_call_metadata:
+        if 'url' not in call_metadata:
+            raise ValueError('Not randomuser.me request metadata: {}'.format(call_metadata))
+        api_url = call_metadata['url']
+        if 'seed' not in parse_qs(urlsplit(api_url).query):
+            api_url = '{}&seed={}'.format(api_url, call_metadata['seed'])
+        api_pages.append((api_url, call_metadata.get('count')))
+    return fetch_api_pages(api_pages, concurrency=concurrency, use_cache=use_cache)
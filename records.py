@@ -0,0 +1,154 @@
+from settings import COPY_TO_FIELDS
+
+
+class EducationRecord:
+    __slots__ = (
+        'degree_name',
+        'graduation_date',
+        'school_name',
+        'school_city',
+        'school_state_or_territory',
+        'school_country',
+        'field_of_study',
+    )
+
+    def __init__(self, degree_name, graduation_date, school_name, school_city, school_state_or_territory,
+                 school_country, field_of_study=None):
+        self.degree_name = degree_name
+        self.graduation_date = graduation_date
+        self.school_name = school_name
+        self.school_city = school_city
+        self.school_state_or_territory = school_state_or_territory
+        self.school_country = school_country
+        self.field_of_study = field_of_study
+
+    def to_dict(self):
+        education_dict = {
+            'degree_name': self.degree_name,
+            'graduation_date': self.graduation_date.isoformat(),
+            'school_name': self.school_name,
+            'school_city': self.school_city,
+            'school_state_or_territory': self.school_state_or_territory,
+            'school_country': self.school_country,
+        }
+        if self.field_of_study is not None:
+            education_dict['field_of_study'] = self.field_of_study
+        return education_dict
+
+
+class EmploymentRecord:
+    __slots__ = (
+        'city',
+        'country',
+        'state_or_territory',
+        'industry',
+        'company_name',
+        'position',
+        'start_date',
+        'end_date',
+    )
+
+    def __init__(self, city, country, state_or_territory, industry, company_name, position=None,
+                 start_date=None, end_date=None):
+        self.city = city
+        self.country = country
+        self.state_or_territory = state_or_territory
+        self.industry = industry
+        self.company_name = company_name
+        self.position = position
+        self.start_date = start_date
+        self.end_date = end_date
+
+    def copy(self):
+        return EmploymentRecord(
+            self.city, self.country, self.state_or_territory, self.industry, self.company_name,
+            position=self.position, start_date=self.start_date, end_date=self.end_date,
+        )
+
+    def to_dict(self):
+        employment_dict = {
+            'city': self.city,
+            'country': self.country,
+            'state_or_territory': self.state_or_territory,
+            'industry': self.industry,
+            'company_name': self.company_name,
+            'position': self.position,
+            'start_date': self.start_date.isoformat(),
+        }
+        if self.end_date is not None:
+            employment_dict['end_date'] = self.end_date.isoformat()
+        return employment_dict
+
+
+class UserRecord:
+    """
+    Compact internal representation of a generated user. Dates are kept as date objects and fields that
+    are copies of other fields (see COPY_TO_FIELDS) are only filled in when the user is serialized.
+    """
+    __slots__ = (
+        'first_name',
+        'last_name',
+        'date_of_birth',
+        'gender',
+        'country',
+        'state_or_territory',
+        'city',
+        'email',
+        'original_country',
+        'education',
+        'work_history',
+        # Enrollment dicts shared with other users in the same program cohort
+        'enrollments',
+        # (edx_course_key, grade) tuples
+        'grades',
+    )
+
+    def __init__(self, first_name, last_name, date_of_birth, gender, country, state_or_territory, city, email):
+        self.first_name = first_name
+        self.last_name = last_name
+        self.date_of_birth = date_of_birth
+        self.gender = gender
+        self.country = country
+        self.state_or_territory = state_or_territory
+        self.city = city
+        self.email = email
+        # Country that the user was created with. Nationality fields keep this value even if the
+        # user's location is changed to another country later.
+        self.original_country = country
+        self.education = []
+        self.work_history = []
+        self.enrollments = None
+        self.grades = None
+
+    def copied_field_source(self, field_name):
+        if field_name == 'country':
+            return self.original_country
+        return getattr(self, field_name)
+
+    def to_dict(self):
+        user_dict = {
+            'first_name': self.first_name,
+            'last_name': self.last_name,
+            'date_of_birth': self.date_of_birth.isoformat(),
+            'gender': self.gender,
+            'country': self.country,
+            'state_or_territory': self.state_or_territory,
+            'city': self.city,
+            'email': self.email,
+        }
+        for copy_tuple in COPY_TO_FIELDS:
+            user_dict[copy_tuple[1]] = self.copied_field_source(copy_tuple[0])
+        user_dict['education'] = [education_record.to_dict() for education_record in self.education]
+        user_dict['work_history'] = [employment_record.to_dict() for employment_record in self.work_history]
+        if self.enrollments is not None:
+            user_dict['_enrollments'] = list(self.enrollments)
+        if self.grades is not None:
+            user_dict['_grades'] = [
+                {'edx_course_key': edx_course_key, 'grade': grade} for edx_course_key, grade in self.grades
+            ]
+        return user_dict
+
+
+def serialize_users(user_records):
+    """Lazily converts user records to dicts so they can be streamed to an output file"""
+    return (user_record.to_dict() for user_record in user_records)
@@ -0,0 +1,224 @@
+import os
+import csv
+import sqlite3
+from itertools import count
+
+from settings import COPY_TO_FIELDS
+
+# Columns of each table, in the order they're written. Every table has a stable integer id (or, for
+# enrollments and grades, a foreign key to a user) so the files can be bulk-loaded in a single pass.
+TABLE_COLUMNS = {
+    'programs': ('id', 'title', 'description', 'financial_aid_availability', 'price'),
+    'courses': ('id', 'program_id', 'title', 'position_in_program', 'description'),
+    'course_runs': (
+        'id', 'course_id', 'edx_course_key', 'title', 'start_date', 'end_date', 'enrollment_start',
+        'enrollment_end', 'upgrade_deadline',
+    ),
+    'users': (
+        'id', 'first_name', 'last_name', 'date_of_birth', 'gender', 'country', 'state_or_territory', 'city',
+        'email',
+    ) + tuple(copy_tuple[1] for copy_tuple in COPY_TO_FIELDS),
+    'education': (
+        'id', 'user_id', 'degree_name', 'graduation_date', 'school_name', 'school_city',
+        'school_state_or_territory', 'school_country', 'field_of_study',
+    ),
+    'work_history': (
+        'id', 'user_id', 'city', 'country', 'state_or_territory', 'industry', 'company_name', 'position',
+        'start_date', 'end_date',
+    ),
+    'enrollments': ('user_id', 'course_run_id', 'edx_course_key'),
+    'grades': ('user_id', 'course_run_id', 'edx_course_key', 'grade'),
+}
+TABLE_SCHEMA = '''
+CREATE TABLE programs (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    description TEXT,
+    financial_aid_availability BOOLEAN,
+    price NUMERIC
+);
+CREATE TABLE courses (
+    id INTEGER PRIMARY KEY,
+    program_id INTEGER NOT NULL REFERENCES programs (id),
+    title TEXT NOT NULL,
+    position_in_program INTEGER,
+    description TEXT
+);
+CREATE TABLE course_runs (
+    id INTEGER PRIMARY KEY,
+    course_id INTEGER NOT NULL REFERENCES courses (id),
+    edx_course_key TEXT NOT NULL UNIQUE,
+    title TEXT,
+    start_date TIMESTAMP,
+    end_date TIMESTAMP,
+    enrollment_start TIMESTAMP,
+    enrollment_end TIMESTAMP,
+    upgrade_deadline TIMESTAMP
+);
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY,
+    first_name TEXT,
+    last_name TEXT,
+    date_of_birth DATE,
+    gender TEXT,
+    country TEXT,
+    state_or_territory TEXT,
+    city TEXT,
+    email TEXT,
+{copied_field_columns}
+);
+CREATE TABLE education (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users (id),
+    degree_name TEXT,
+    graduation_date DATE,
+    school_name TEXT,
+    school_city TEXT,
+    school_state_or_territory TEXT,
+    school_country TEXT,
+    field_of_study TEXT
+);
+CREATE TABLE work_history (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users (id),
+    city TEXT,
+    country TEXT,
+    state_or_territory TEXT,
+    industry TEXT,
+    company_name TEXT,
+    position TEXT,
+    start_date DATE,
+    end_date DATE
+);
+CREATE TABLE enrollments (
+    user_id INTEGER NOT NULL REFERENCES users (id),
+    course_run_id INTEGER NOT NULL REFERENCES course_runs (id),
+    edx_course_key TEXT NOT NULL
+);
+CREATE TABLE grades (
+    user_id INTEGER NOT NULL REFERENCES users (id),
+    course_run_id INTEGER NOT NULL REFERENCES course_runs (id),
+    edx_course_key TEXT NOT NULL,
+    grade NUMERIC
+);
+'''.format(copied_field_columns=',\n'.join('    {} TEXT'.format(copy_tuple[1]) for copy_tuple in COPY_TO_FIELDS))
+# Number of rows inserted per executemany call when loading into SQLite
+SQLITE_BATCH_SIZE = 10000
+
+
+def iter_program_rows(all_program_data, course_run_ids):
+    """
+    Yields (table_name, row) tuples for programs, courses and course runs. Course run ids are added
+    to course_run_ids (keyed by edx course key) so enrollments and grades can refer to them.
+    """
+    course_ids = count(1)
+    for program_id, program_data in enumerate(all_program_data, start=1):
+        yield 'programs', (
+            program_id,
+            program_data['title'],
+            program_data.get('description'),
+            program_data.get('financial_aid_availability'),
+            program_data.get('_price'),
+        )
+        for course_data in program_data['courses']:
+            course_id = next(course_ids)
+            yield 'courses', (
+                course_id,
+                program_id,
+                course_data['title'],
+                course_data.get('position_in_program'),
+                course_data.get('description'),
+            )
+            for course_run in course_data['course_runs']:
+                course_run_id = len(course_run_ids) + 1
+                course_run_ids[course_run['edx_course_key']] = course_run_id
+                yield 'course_runs', (course_run_id, course_id) + tuple(
+                    course_run.get(column) for column in TABLE_COLUMNS['course_runs'][2:]
+                )
+
+
+def iter_user_rows(user_dicts, course_run_ids):
+    """Yields (table_name, row) tuples for serialized users and everything nested in them"""
+    education_ids = count(1)
+    employment_ids = count(1)
+    for user_id, user in enumerate(user_dicts, start=1):
+        yield 'users', (user_id,) + tuple(user.get(column) for column in TABLE_COLUMNS['users'][1:])
+        for education in user['education']:
+            yield 'education', (next(education_ids), user_id) + tuple(
+                education.get(column) for column in TABLE_COLUMNS['education'][2:]
+            )
+        for employment in user['work_history']:
+            yield 'work_history', (next(employment_ids), user_id) + tuple(
+                employment.get(column) for column in TABLE_COLUMNS['work_history'][2:]
+            )
+        for enrollment in user.get('_enrollments', []):
+            edx_course_key = enrollment['edx_course_key']
+            yield 'enrollments', (user_id, course_run_ids[edx_course_key], edx_course_key)
+        for grade in user.get('_grades', []):
+            edx_course_key = grade['edx_course_key']
+            yield 'grades', (user_id, course_run_ids[edx_course_key], edx_course_key, grade['grade'])
+
+
+def iter_relational_rows(user_dicts, all_program_data):
+    course_run_ids = {}
+    yield from iter_program_rows(all_program_data, course_run_ids)
+    yield from iter_user_rows(user_dicts, course_run_ids)
+
+
+def write_relational_csv(user_dicts, all_program_data, output_dir):
+    """
+    Writes one CSV file per table to output_dir, along with a schema.sql file that creates the tables
+    and loads the files with COPY (via psql's \\copy)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    files = {}
+    writers = {}
+    try:
+        for table_name, columns in TABLE_COLUMNS.items():
+            files[table_name] = open(
+                os.path.join(output_dir, '{}.csv'.format(table_name)), 'w', newline='', encoding='utf-8'
+            )
+            writers[table_name] = csv.writer(files[table_name])
+            writers[table_name].writerow(columns)
+        for table_name, row in iter_relational_rows(user_dicts, all_program_data):
+            writers[table_name].writerow(row)
+    finally:
+        for f in files.values():
+            f.close()
+    with open(os.path.join(output_dir, 'schema.sql'), 'w') as f:
+        f.write(TABLE_SCHEMA)
+        for table_name, columns in TABLE_COLUMNS.items():
+            f.write("\\copy {} ({}) FROM '{}.csv' WITH (FORMAT csv, HEADER true)\n".format(
+                table_name, ', '.join(columns), table_name
+            ))
+
+
+def write_relational_sqlite(user_dicts, all_program_data, db_path, batch_size=SQLITE_BATCH_SIZE):
+    """Creates the tables in a new SQLite database and loads them with batched executemany calls"""
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    connection = sqlite3.connect(db_path)
+    try:
+        # Nothing else is using the database while it's loaded, so skip journaling and fsyncs
+        connection.execute('PRAGMA journal_mode = OFF')
+        connection.execute('PRAGMA synchronous = OFF')
+        connection.executescript(TABLE_SCHEMA)
+        insert_statements = {
+            table_name: 'INSERT INTO {} ({}) VALUES ({})'.format(
+                table_name, ', '.join(columns), ', '.join('?' * len(columns))
+            )
+            for table_name, columns in TABLE_COLUMNS.items()
+        }
+        batches = {table_name: [] for table_name in TABLE_COLUMNS}
+        with connection:
+            for table_name, row in iter_relational_rows(user_dicts, all_program_data):
+                batch = batches[table_name]
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    connection.executemany(insert_statements[table_name], batch)
+                    batch.clear()
+            for table_name, batch in batches.items():
+                if batch:
+                    connection.executemany(insert_statements[table_name], batch)
+    finally:
+        connection.close()
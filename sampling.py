@@ -0,0 +1,71 @@
+import random
+
+
+def build_alias_table(weights):
+    """
+    Builds the probability and alias lists for Vose's alias method, so a weighted draw takes a single
+    random number no matter how many keys there are
+    """
+    key_count = len(weights)
+    total_weight = float(sum(weights))
+    scaled_weights = [weight * key_count / total_weight for weight in weights]
+    probabilities = [1.0] * key_count
+    aliases = list(range(key_count))
+    small = [i for i, weight in enumerate(scaled_weights) if weight < 1.0]
+    large = [i for i, weight in enumerate(scaled_weights) if weight >= 1.0]
+    while small and large:
+        (small_index, large_index) = (small.pop(), large.pop())
+        probabilities[small_index] = scaled_weights[small_index]
+        aliases[small_index] = large_index
+        scaled_weights[large_index] -= 1.0 - scaled_weights[small_index]
+        if scaled_weights[large_index] < 1.0:
+            small.append(large_index)
+        else:
+            large.append(large_index)
+    # Anything left over has a scaled weight of 1 (give or take rounding error), so it's never aliased
+    return probabilities, aliases
+
+
+class Sampler:
+    """
+    Draws random keys from a fixed collection (eg: the keys of a settings dict). The keys are stored as a
+    tuple once, instead of being copied into a new list for every draw. If weights are given, keys are drawn
+    in proportion to them using an alias table.
+    """
+    __slots__ = ('keys', 'probabilities', 'aliases')
+
+    def __init__(self, keys, weights=None):
+        self.keys = tuple(keys)
+        if not self.keys:
+            raise ValueError('Sampler needs at least one key')
+        if weights is None:
+            (self.probabilities, self.aliases) = (None, None)
+        else:
+            if len(weights) != len(self.keys):
+                raise ValueError('Sampler needs exactly one weight per key')
+            if min(weights) < 0 or not sum(weights) > 0:
+                raise ValueError('Sampler weights must not be negative, and at least one must be positive')
+            (self.probabilities, self.aliases) = build_alias_table(weights)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def weighted_index(self, rng):
+        # The integer part of the scaled draw picks a column of the alias table, and the rest decides
+        # between the column's own key and its alias
+        scaled = rng.random() * len(self.keys)
+        index = int(scaled)
+        return index if scaled - index < self.probabilities[index] else self.aliases[index]
+
+    def draw(self, rng=random):
+        if self.probabilities is None:
+            # Same draw as random_key/random_item_from_iterable, so seeded output doesn't change
+            return rng.choice(self.keys)
+        return self.keys[self.weighted_index(rng)]
+
+    def sample(self, k, rng=random):
+        """Draws k keys (with replacement) in one call"""
+        if self.probabilities is None:
+            return rng.choices(self.keys, k=k)
+        keys = self.keys
+        return [keys[self.weighted_index(rng)] for _ in range(k)]
@@ -0,0 +1,233 @@
+import re
+import json
+import random
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import settings
+from utils import iter_json_lines_batches
+from randomuser_client import (
+    get_all_user_api_results,
+    create_param_groups,
+    determine_user_count_per_group,
+    RANDOMUSER_URL,
+    API_CONCURRENCY,
+)
+from localuser_client import local_user_iter, LOCAL_SOURCE_NAME
+from settings import USERS_TO_GENERATE
+from api import build_full_program_data
+from records import serialize_users
+from streaming import plan_streaming_generation, iter_streamed_users
+
+SERVICE_HOST = '127.0.0.1'
+SERVICE_PORT = 8642
+MAX_SERVICE_USER_COUNT = 1000000
+# Total number of randomuser.me results (across every user count and seed) that are kept in memory. Responses
+# are also cached on disk (see api_cache), so results that don't fit are only re-read, not re-fetched.
+RAW_RESULTS_CACHE_MAX_RECORDS = 200000
+# Seeds are echoed back in a response header, so they're limited to characters that are safe there
+SEED_PATTERN = re.compile(r'[A-Za-z0-9_.:-]{1,64}')
+# Number of users that are encoded before each write to the response
+SERVICE_WRITE_BATCH_SIZE = 100
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+JSON_CONTENT_TYPE = 'application/json'
+
+
+class RawResultsCache:
+    """Keeps the most recently used sets of raw user results in memory, up to a total number of records"""
+    def __init__(self, max_records=RAW_RESULTS_CACHE_MAX_RECORDS):
+        self.max_records = max_records
+        self.record_count = 0
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, load_results):
+        with self.lock:
+            if key in self.results:
+                self.results.move_to_end(key)
+                return self.results[key]
+        # Results are loaded outside of the lock so other requests aren't held up by a slow fetch
+        results = load_results()
+        if len(results) > self.max_records:
+            return results
+        with self.lock:
+            if key not in self.results:
+                self.results[key] = results
+                self.record_count += len(results)
+            while self.record_count > self.max_records:
+                (_, evicted_results) = self.results.popitem(last=False)
+                self.record_count -= len(evicted_results)
+        return results
+
+
+class GenerationService:
+    """
+    Settings, samplers, program data and raw user results that are loaded once and shared by every request.
+    Users are generated with the streaming pipeline, so the users for a count and seed are the same as the
+    user data file written by generate.py with the same count, seed and source.
+    """
+    def __init__(self, source=LOCAL_SOURCE_NAME, api_url=RANDOMUSER_URL, concurrency=API_CONCURRENCY,
+                 use_api_cache=True):
+        self.source = source
+        self.api_url = api_url
+        self.concurrency = concurrency
+        self.use_api_cache = use_api_cache
+        # Loads the JSON settings and builds their samplers up front instead of on the first request
+        settings.FIELD_OF_STUDY_SAMPLER
+        self.program_data = build_full_program_data()
+        self.programs_by_title = {program_data['title']: program_data for program_data in self.program_data}
+        self.raw_results_cache = RawResultsCache()
+
+    def fetch_api_results(self, user_count, seed):
+        (api_result_data, _) = get_all_user_api_results(
+            base_url=self.api_url,
+            concurrency=self.concurrency,
+            seed=seed,
+            use_cache=self.use_api_cache,
+            user_count=user_count,
+        )
+        return api_result_data
+
+    def user_results_source(self, user_count, seed):
+        """Gets a function that returns a new iterator over the raw results for a user count and seed"""
+        if self.source == LOCAL_SOURCE_NAME:
+            user_count_per_group = determine_user_count_per_group(user_count)
+            return lambda: local_user_iter(user_count_per_group, seed)
+        user_results = self.raw_results_cache.get(
+            (user_count, seed), lambda: self.fetch_api_results(user_count, seed)
+        )
+        return lambda: iter(user_results)
+
+    def iter_users(self, user_count, seed, program_title=None):
+        """
+        Plans the users for a user count and seed, and returns an iterator that creates them one shard at a
+        time. If a program title is given, every enrolled user is enrolled in that program.
+        """
+        if program_title is None:
+            program_data = self.program_data
+        else:
+            program_data = [self.programs_by_title[program_title]]
+        user_results_source = self.user_results_source(user_count, seed)
+        plan = plan_streaming_generation(user_results_source(), program_data, seed)
+        return iter_streamed_users(user_results_source(), plan, seed)
+
+
+def parse_user_count(query):
+    user_count = int(query.get('count', [USERS_TO_GENERATE])[0])
+    # Users are generated in equal groups (see determine_user_count_per_group), so less than one per group is none
+    min_user_count = len(create_param_groups())
+    if not min_user_count <= user_count <= MAX_SERVICE_USER_COUNT:
+        raise ValueError('count must be between {} and {}'.format(min_user_count, MAX_SERVICE_USER_COUNT))
+    return user_count
+
+
+def parse_seed(query):
+    """Gets the seed param, or a random seed if there isn't one"""
+    if 'seed' not in query:
+        return '{:016x}'.format(random.getrandbits(64))
+    seed = query['seed'][0]
+    if not SEED_PATTERN.fullmatch(seed):
+        raise ValueError('seed must be 1-64 letters, digits or any of "_.:-"')
+    return seed
+
+
+class GenerationRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves:
+      GET /users?count=N&seed=S&program=X   About N users as JSON Lines, streamed as they're created. Without a
+                                            seed, a random one is used. The seed is returned in an X-Seed header.
+      GET /programs                         The program data that users are enrolled in
+
+    Error details can include request values, so they're only sent in the (escaped) error page, never in the
+    status line, which send_error writes as-is.
+    """
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/users':
+            self.send_users(query)
+        elif url.path == '/programs':
+            self.send_json(self.server.service.program_data)
+        else:
+            self.send_error(404, 'Unknown path', url.path)
+
+    def send_json(self, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', JSON_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_users(self, query):
+        service = self.server.service
+        try:
+            user_count = parse_user_count(query)
+            seed = parse_seed(query)
+        except ValueError as e:
+            self.send_error(400, 'Invalid query params', str(e))
+            return
+        program_title = query['program'][0] if 'program' in query else None
+        if program_title is not None and program_title not in service.programs_by_title:
+            self.send_error(404, 'Unknown program', program_title)
+            return
+        try:
+            users = service.iter_users(user_count, seed, program_title=program_title)
+        except OSError as e:
+            self.send_error(502, 'Could not get raw user results', str(e))
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', NDJSON_CONTENT_TYPE)
+        self.send_header('X-Seed', seed)
+        self.end_headers()
+        try:
+            for batch in iter_json_lines_batches(serialize_users(users), batch_size=SERVICE_WRITE_BATCH_SIZE):
+                self.wfile.write(batch.encode('utf-8'))
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, so the rest of the users aren't needed
+            pass
+
+
+class GenerationServer(ThreadingHTTPServer):
+    """HTTP server that handles each request in its own thread, sharing one GenerationService"""
+    daemon_threads = True
+
+    def __init__(self, server_address, service):
+        super().__init__(server_address, GenerationRequestHandler)
+        self.service = service
+
+
+parser = argparse.ArgumentParser(description='''
+    Serves realistic user data over HTTP, keeping settings, program data and randomuser.me results loaded
+     between requests. See GenerationRequestHandler for the endpoints.
+''')
+parser.add_argument('--host', default=SERVICE_HOST, help='Address to listen on (default: %(default)s)')
+parser.add_argument('--port', type=int, default=SERVICE_PORT, help='Port to listen on (default: %(default)s)')
+parser.add_argument('--source', choices=['api', LOCAL_SOURCE_NAME], default=LOCAL_SOURCE_NAME,
+                    help="Where raw user records come from: randomuser.me ('api') or the offline local generator "
+                         "('{}') (default: %(default)s)".format(LOCAL_SOURCE_NAME))
+parser.add_argument('--api-url', default=RANDOMUSER_URL, help='Base URL of the randomuser.me-compatible API')
+parser.add_argument('--concurrency', type=int, default=API_CONCURRENCY,
+                    help='Number of concurrent randomuser.me requests (default: %(default)s)')
+parser.add_argument('--no-api-cache', action='store_true',
+                    help="Don't read or write the per-request cache of randomuser.me responses")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    generation_service = GenerationService(
+        source=args.source,
+        api_url=args.api_url,
+        concurrency=args.concurrency,
+        use_api_cache=not args.no_api_cache,
+    )
+    server = GenerationServer((args.host, args.port), generation_service)
+    print('Serving on http://{}:{}/'.format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
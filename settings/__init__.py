@@ -1,16 +1,45 @@
-from utils import load_json_from_file
+import os
+import pickle
+import tempfile
+from datetime import date
+
+import sampling
+from utils import load_json_from_file, build_normalized_lookup
+from sampling import Sampler
 from path import (
     FIELDS_OF_STUDY_PATH,
     US_STATE_CODE_MAP,
     CANADA_STATE_CODE_MAP,
     SPAIN_STATE_CODE_MAP,
+    LOCAL_USER_NAMES_PATH,
+    SETTINGS_CACHE_PATH,
 )
 
 USERS_TO_GENERATE = 120
+# Number of raw user results in each shard when users are created with a seed and/or a process pool.
+# Each shard gets its own random stream, so changing this changes seeded output.
+USER_SHARD_SIZE = 10000
+# Percentage of users that are moved to a location in a different country than their nationality
+PCT_USERS_MOVED = 0.1
 # Percentage of users to be enrolled in at least one course.
 # Users will be divided evenly among the fake programs.
 PCT_USERS_ENROLLED = 0.9
 
+# Cohorts of enrolled users that get enrollments/grades in a range of adjacent programs. 'pct' is the
+# percentage of all enrolled users, and each user is enrolled/graded in the first courses of each program.
+CROSS_PROGRAM_EDX_COHORTS = [
+    {'pct': 0.2, 'programs': 2, 'enrollments': 1, 'grades': 1},
+]
+# Cohorts of the remaining enrolled users, who are split evenly among the programs. 'pct' is the percentage
+# of a program's users, and a cohort with a 'pct' of None gets the rest of them.
+PROGRAM_EDX_COHORTS = [
+    {'pct': 0.3, 'enrollments': 1, 'grades': 1},
+    {'pct': 0.5, 'enrollments': 2, 'grades': 2},
+    {'pct': 0.1, 'enrollments': 3, 'grades': 3},
+    {'pct': None, 'enrollments': 2, 'grades': 1},
+]
+GRADE_RANGE = (60, 100)
+
 # Course settings
 PAST_COURSE_RUNS_TO_CREATE = 3
 COURSE_RUN_MONTH_RANGES = [(1, 5), (8, 12)]
@@ -18,7 +47,6 @@ COURSE_DAY = 15
 ENROLLMENT_DELTA = dict(days=14)
 UPGRADE_DELTA = dict(days=7)
 
-FIELDS_OF_STUDY = load_json_from_file(FIELDS_OF_STUDY_PATH)
 DEGREES = {
     'MASTERS': {
         'name': 'm',
@@ -59,10 +87,11 @@ EMPLOYMENT = {
 }
 EMPLOYMENT_YEAR_LENGTH = 2
 
-COUNTRY_STATE_CODE_MAP = {
-    'US': load_json_from_file(US_STATE_CODE_MAP),
-    'CA': load_json_from_file(CANADA_STATE_CODE_MAP),
-    'ES': load_json_from_file(SPAIN_STATE_CODE_MAP)
+# Samplers for random draws that are made for every user, built once here instead of on every draw
+INDUSTRY_SAMPLER = Sampler(EMPLOYMENT)
+COMPANY_SAMPLERS = {
+    industry: Sampler(employment_info['company_name'])
+    for industry, employment_info in EMPLOYMENT.items()
 }
 
 COPY_TO_FIELDS = [
@@ -71,3 +100,110 @@ COPY_TO_FIELDS = [
     ('first_name', 'preferred_name'),
     ('first_name', 'edx_name')
 ]
+
+# Range of birth dates for users created by the offline local user generator. These are fixed dates
+# (rather than ages) so that a given seed produces the same records no matter when it's run.
+LOCAL_USER_DOB_RANGE = (date(1945, 1, 1), date(2004, 12, 31))
+
+
+def load_data_settings():
+    """Loads the settings that come from the JSON files in this directory, along with values derived from them"""
+    fields_of_study = load_json_from_file(FIELDS_OF_STUDY_PATH)
+    country_state_code_map = {
+        'US': load_json_from_file(US_STATE_CODE_MAP),
+        'CA': load_json_from_file(CANADA_STATE_CODE_MAP),
+        'ES': load_json_from_file(SPAIN_STATE_CODE_MAP)
+    }
+    return {
+        'FIELDS_OF_STUDY': fields_of_study,
+        'FIELD_OF_STUDY_SAMPLER': Sampler(fields_of_study),
+        'COUNTRY_STATE_CODE_MAP': country_state_code_map,
+        'STATE_CODE_SAMPLERS': {
+            country: Sampler(state_code_map)
+            for country, state_code_map in country_state_code_map.items()
+        },
+        # State codes keyed by casefolded, accent-stripped state name (see utils.normalize_lookup_key)
+        'COUNTRY_STATE_LOOKUP_MAP': {
+            country: build_normalized_lookup(state_code_map)
+            for country, state_code_map in country_state_code_map.items()
+        },
+        # State code that's used when a state name can't be found in a country's state map
+        'DEFAULT_STATE_CODE_MAP': {
+            country: next(iter(state_code_map.values()))
+            for country, state_code_map in country_state_code_map.items()
+        },
+        # Name and city pools used by the offline local user generator, keyed by nationality
+        'LOCAL_USER_NAMES': load_json_from_file(LOCAL_USER_NAMES_PATH),
+    }
+
+
+# Settings returned by load_data_settings. They aren't loaded until one of them is first accessed as an
+# attribute of this module (eg: settings.FIELDS_OF_STUDY), so importing settings doesn't parse any JSON.
+DATA_SETTING_NAMES = frozenset([
+    'FIELDS_OF_STUDY',
+    'FIELD_OF_STUDY_SAMPLER',
+    'COUNTRY_STATE_CODE_MAP',
+    'STATE_CODE_SAMPLERS',
+    'COUNTRY_STATE_LOOKUP_MAP',
+    'DEFAULT_STATE_CODE_MAP',
+    'LOCAL_USER_NAMES',
+])
+DATA_SETTINGS_SOURCE_PATHS = [
+    FIELDS_OF_STUDY_PATH,
+    US_STATE_CODE_MAP,
+    CANADA_STATE_CODE_MAP,
+    SPAIN_STATE_CODE_MAP,
+    LOCAL_USER_NAMES_PATH,
+    # The code that builds the settings
+    os.path.abspath(__file__),
+    os.path.abspath(sampling.__file__),
+]
+
+
+def data_settings_cache_key():
+    """Identifies the version of every file that the data settings are built from"""
+    key = []
+    for path in DATA_SETTINGS_SOURCE_PATHS:
+        stat_result = os.stat(path)
+        key.append((path, stat_result.st_mtime_ns, stat_result.st_size))
+    return key
+
+
+def load_cached_data_settings(cache_path=SETTINGS_CACHE_PATH):
+    """
+    Loads the data settings from a pickle cache, which is rebuilt whenever any of the files they come from
+    has changed. If the cache can't be read or written, the settings are loaded from the JSON files.
+    """
+    cache_key = data_settings_cache_key()
+    try:
+        with open(cache_path, 'rb') as f:
+            (cached_key, data_settings) = pickle.load(f)
+        if cached_key == cache_key:
+            return data_settings
+    except Exception:
+        # A missing, partial or outdated cache is just rebuilt
+        pass
+    data_settings = load_data_settings()
+    try:
+        (fd, temp_path) = tempfile.mkstemp(dir=os.path.dirname(cache_path), prefix='.settings_cache.')
+    except OSError:
+        return data_settings
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((cache_key, data_settings), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+    except Exception:
+        # The settings are still usable without a cache
+        pass
+    finally:
+        # The temp file is only left if it couldn't be moved into place
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return data_settings
+
+
+def __getattr__(name):
+    if name in DATA_SETTING_NAMES:
+        globals().update(load_cached_data_settings())
+        return globals()[name]
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
@@ -0,0 +1,155 @@
+from array import array
+from collections import defaultdict
+from multiprocessing import Pool
+
+from utils import chunk_iterable, derive_rng
+from randomuser_client import parse_randomuser_location, add_worker_state_lookup_misses
+from api import (
+    GRADE_VALUES,
+    create_user_shard,
+    create_worker_user_shard,
+    plan_nationality_swaps,
+    iter_edx_cohorts,
+)
+from dedupe import EmailDeduplicator, email_hash
+from settings import USER_SHARD_SIZE
+
+# Drawing grades from this range with rng.choices takes the same random numbers as drawing from GRADE_VALUES,
+# so grade indices can be stored instead of grades without changing the output
+GRADE_INDICES = range(len(GRADE_VALUES))
+NO_COHORT = -1
+
+
+class StreamingUserIndex:
+    """
+    Compact keys for every user, collected in a first pass over raw results: the user's location (as an id in
+    a table of distinct locations) and a hash of their email. Location ids are also grouped by country, in the
+    same way as build_country_location_index, so nationality swaps can be drawn from them.
+    """
+    def __init__(self):
+        self.user_count = 0
+        self.locations = []
+        self.location_ids = {}
+        self.user_location_ids = array('I')
+        self.location_index = defaultdict(lambda: array('I'))
+        self.email_hashes = array('Q')
+
+    def add(self, user_result):
+        # State lookup misses are counted when the user is actually created in the second pass
+        location = parse_randomuser_location(user_result, record_misses=False)
+        location_id = self.location_ids.get(location)
+        if location_id is None:
+            location_id = self.location_ids[location] = len(self.locations)
+            self.locations.append(location)
+        self.user_location_ids.append(location_id)
+        self.location_index[location[0]].append(location_id)
+        self.email_hashes.append(email_hash(user_result['email']))
+        self.user_count += 1
+
+    def user_country(self, i):
+        return self.locations[self.user_location_ids[i]][0]
+
+
+class EdxPlan:
+    """
+    Enrollments and grades for every user, decided up front. Each user gets a cohort id and a position in that
+    cohort, and each cohort keeps its shared enrollments, graded course keys and the grade indices of its users.
+    """
+    def __init__(self, user_count):
+        self.cohorts = []
+        self.user_cohorts = array('i', [NO_COHORT]) * user_count
+        self.user_positions = array('I', [0]) * user_count
+
+    def add_cohort(self, user_indices, enrollments, graded_course_keys, rng):
+        # Grades are drawn for the whole cohort at once, as in assign_edx_cohort
+        grade_indices = bytes(rng.choices(GRADE_INDICES, k=len(user_indices) * len(graded_course_keys)))
+        cohort_id = len(self.cohorts)
+        self.cohorts.append((enrollments, graded_course_keys, grade_indices))
+        for position, i in enumerate(user_indices):
+            self.user_cohorts[i] = cohort_id
+            self.user_positions[i] = position
+
+    def apply(self, user, i):
+        cohort_id = self.user_cohorts[i]
+        if cohort_id == NO_COHORT:
+            return
+        (enrollments, graded_course_keys, grade_indices) = self.cohorts[cohort_id]
+        grade_count = len(graded_course_keys)
+        start = self.user_positions[i] * grade_count
+        user.enrollments = enrollments
+        user.grades = list(zip(
+            graded_course_keys,
+            [GRADE_VALUES[grade_index] for grade_index in grade_indices[start:start + grade_count]],
+        ))
+
+
+class StreamingPlan:
+    """Everything that's decided in the first pass and applied to users as they're created in the second pass"""
+    def __init__(self, user_count, deduplicator, swaps, edx_plan):
+        self.user_count = user_count
+        self.deduplicator = deduplicator
+        self.swaps = swaps
+        self.edx_plan = edx_plan
+
+
+def plan_streaming_generation(user_results, all_program_data, seed):
+    """
+    First pass: indexes raw results and decides duplicate emails, nationality swaps and enrollments/grades for
+    every user. The same derived random streams are used as in generate_user_and_program_data, so the plan
+    matches what it would do with the same seed.
+    """
+    index = StreamingUserIndex()
+    for user_result in user_results:
+        index.add(user_result)
+
+    deduplicator = EmailDeduplicator(index.user_count)
+    for key_hash in index.email_hashes:
+        deduplicator.add_email_hash(key_hash)
+    index.email_hashes = None
+
+    swaps = {
+        i: index.locations[location_id]
+        for i, location_id in plan_nationality_swaps(
+            index.user_count, index.user_country, index.location_index, rng=derive_rng(seed, 'edit')
+        )
+    }
+
+    edx_plan = EdxPlan(index.user_count)
+    edx_rng = derive_rng(seed, 'edx')
+    for user_indices, enrollments, graded_course_keys in iter_edx_cohorts(
+            index.user_count, all_program_data, rng=edx_rng):
+        edx_plan.add_cohort(user_indices, enrollments, graded_course_keys, rng=edx_rng)
+
+    return StreamingPlan(index.user_count, deduplicator, swaps, edx_plan)
+
+
+def iter_user_shards(shards, workers=1):
+    if workers <= 1:
+        yield from map(create_user_shard, shards)
+        return
+    with Pool(workers) as pool:
+        # Pool.imap reads all of its input up front, so shards are handed over a few at a time to keep
+        # the number of raw results in memory bounded
+        for shard_window in chunk_iterable(shards, workers * 2):
+            yield from add_worker_state_lookup_misses(pool.imap(create_worker_user_shard, shard_window))
+
+
+def iter_streamed_users(user_results, plan, seed, workers=1):
+    """
+    Second pass: creates users from raw results one shard at a time and applies the plan to each of them,
+    yielding finished users in order so they can be written as they're created
+    """
+    shards = (
+        (seed, shard_index, shard_results)
+        for shard_index, shard_results in enumerate(chunk_iterable(user_results, USER_SHARD_SIZE))
+    )
+    user_index = 0
+    for user_shard in iter_user_shards(shards, workers=workers):
+        for user in user_shard:
+            user.email = plan.deduplicator.unique_email(user.email)
+            location = plan.swaps.get(user_index)
+            if location is not None:
+                (user.country, user.state_or_territory, user.city) = location
+            plan.edx_plan.apply(user, user_index)
+            yield user
+            user_index += 1
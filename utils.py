@@ -1,11 +1,42 @@
 import os
 import json
+import gzip
+import lzma
+import unicodedata
 import random
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
-import dateutil.parser
-from itertools import product
-from random import randint
+from itertools import product, islice
+
+
+COMPRESSION_OPENERS = {
+    'gzip': gzip.open,
+    'lzma': lzma.open,
+}
+COMPRESSION_SUFFIXES = {
+    'gzip': '.gz',
+    'lzma': '.xz',
+}
+# Number of JSON Lines records that are joined together before each write
+JSON_LINES_WRITE_BATCH_SIZE = 1000
+# Number of characters read at a time when incrementally parsing a JSON array
+JSON_READ_CHUNK_SIZE = 1 << 16
+
+
+def compressed_path(path, compression=None):
+    return path + COMPRESSION_SUFFIXES[compression] if compression else path
+
+
+def compression_from_path(path):
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if path.endswith(suffix):
+            return compression
+    return None
+
+
+def open_text_file(path, mode='r', compression=None):
+    if compression:
+        return COMPRESSION_OPENERS[compression](path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
 
 
 def load_json_from_file(path):
@@ -14,11 +45,137 @@ def load_json_from_file(path):
     return data
 
 
-def write_json_to_file(data, path):
-    with open(path, 'w') as f:
+def iter_json_array_records(f):
+    """Incrementally decodes the items of a JSON array from a file object positioned just after the '['"""
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+    while True:
+        # Skip whitespace and separators between items
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            pos += 1
+        if pos < len(buf) and buf[pos] == ']':
+            return
+        try:
+            if pos == len(buf):
+                raise ValueError('Need more data')
+            record, end = decoder.raw_decode(buf, pos)
+            # A value that runs to the end of the buffer (eg: a number) might be cut off
+            if end == len(buf) and not eof:
+                raise ValueError('Need more data')
+        except ValueError:
+            if eof:
+                raise ValueError('Unexpected end of JSON array data')
+            # Read at least as much as is buffered so a large record is re-decoded a logarithmic number of times
+            chunk = f.read(max(JSON_READ_CHUNK_SIZE, len(buf) - pos))
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        yield record
+        pos = end
+
+
+def read_first_non_space_char(f):
+    first_char = f.read(1)
+    while first_char and first_char.isspace():
+        first_char = f.read(1)
+    return first_char
+
+
+def is_json_array_file(path):
+    """Checks whether a (possibly compressed) JSON file holds an array, as opposed to JSON Lines"""
+    with open_text_file(path, 'r', compression=compression_from_path(path)) as f:
+        return read_first_non_space_char(f) == '['
+
+
+def iter_json_records_from_file(path):
+    """
+    Yields records one at a time from a file containing either a JSON array or JSON Lines, so the
+    whole file never needs to be held in memory. Compression is inferred from the file suffix.
+    """
+    with open_text_file(path, 'r', compression=compression_from_path(path)) as f:
+        if read_first_non_space_char(f) == '[':
+            yield from iter_json_array_records(f)
+        else:
+            f.seek(0)
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def write_json_to_file(data, path, compression=None):
+    with open_text_file(path, 'w', compression=compression) as f:
         json.dump(data, f, indent=4)
 
 
+def write_json_array_to_file(records, path, compression=None, record_offsets=None):
+    """
+    Streams records to a file as a pretty-printed JSON array, encoding one record at a time. The output
+    is the same as write_json_to_file for a list of the same records. If a record_offsets array is given,
+    the (uncompressed) byte offset where each record starts is added to it, followed by the offset where
+    the last record ends.
+    """
+    encode = json.JSONEncoder(indent=4).encode
+    # The encoder escapes non-ASCII characters, so the length of the text written is its length in bytes
+    offset = 0
+    with open_text_file(path, 'w', compression=compression) as f:
+        separator = '[\n    '
+        for record in records:
+            f.write(separator)
+            record_text = encode(record).replace('\n', '\n    ')
+            f.write(record_text)
+            if record_offsets is not None:
+                offset += len(separator)
+                record_offsets.append(offset)
+                offset += len(record_text)
+            separator = ',\n    '
+        f.write('[]' if separator == '[\n    ' else '\n]')
+    if record_offsets is not None:
+        record_offsets.append(offset)
+
+
+def iter_json_lines_batches(records, batch_size=JSON_LINES_WRITE_BATCH_SIZE, record_offsets=None, start_offset=0):
+    """
+    Encodes records as compact JSON, one record per line, yielding the text of batch_size lines at a time.
+    If a record_offsets array is given, the byte offset where each line starts (counting from start_offset)
+    is added to it, followed by the offset where the last line ends.
+    """
+    encode = json.JSONEncoder(separators=(',', ':')).encode
+    # The encoder escapes non-ASCII characters, so the length of each line is its length in bytes
+    offset = start_offset
+    lines = []
+    for record in records:
+        line = encode(record)
+        lines.append(line)
+        if record_offsets is not None:
+            record_offsets.append(offset)
+            offset += len(line) + 1
+        if len(lines) == batch_size:
+            lines.append('')
+            yield '\n'.join(lines)
+            lines = []
+    if lines:
+        lines.append('')
+        yield '\n'.join(lines)
+    if record_offsets is not None:
+        record_offsets.append(offset)
+
+
+def write_json_lines_to_file(records, path, compression=None, append=False, record_offsets=None):
+    """
+    Streams records to a file as compact JSON, one record per line. If append is True, records are added to
+    the end of an existing file (a compressed file gets a new compressed stream, which readers handle).
+    If a record_offsets array is given, the (uncompressed) byte offsets of the new lines are added to it
+    as in iter_json_lines_batches.
+    """
+    start_offset = os.path.getsize(path) if append and os.path.isfile(path) else 0
+    with open_text_file(path, 'a' if append else 'w', compression=compression) as f:
+        for batch in iter_json_lines_batches(records, record_offsets=record_offsets, start_offset=start_offset):
+            f.write(batch)
+
+
 def datetime_from_epoch(epoch_time):
     return datetime.fromtimestamp(epoch_time)
 
@@ -29,31 +186,46 @@ def date_from_randomuser_dob(dob):
 
 
 def year_diff(start_date, end_date):
+    # dateutil is only imported when it's needed, since it's slow to import
+    from dateutil.relativedelta import relativedelta
     return relativedelta(end_date, start_date).years
 
 
 def increment_year(date, years):
-    return date.replace(year=date.year + years)
+    try:
+        return date.replace(year=date.year + years)
+    except ValueError:
+        # Feb 29 doesn't exist in the target year
+        return date.replace(year=date.year + years, day=28)
 
 
 def parse_iso_datetime(iso):
+    import dateutil.parser
     return dateutil.parser.parse(iso)
 
 
-def random_item_from_iterable(iterable):
-    return random.choice(iterable)
+def derive_rng(seed, *keys):
+    """
+    Creates a random number generator whose stream is determined by a master seed and a set of keys
+    (eg: a shard index). String seeds are hashed with SHA-512, so the stream is the same in every process.
+    """
+    return random.Random(':'.join(str(part) for part in (seed,) + keys))
+
 
+def random_item_from_iterable(iterable, rng=random):
+    return rng.choice(iterable)
 
-def random_index_from_iterable(iterable):
-    return random.choice(range(len(iterable)))
 
+def random_index_from_iterable(iterable, rng=random):
+    return rng.choice(range(len(iterable)))
 
-def random_key(d):
-    return random_item_from_iterable(list(d.keys()))
 
+def random_key(d, rng=random):
+    return random_item_from_iterable(list(d.keys()), rng=rng)
 
-def random_n_up_to_limit(n, range_limit):
-    return random.sample(range(range_limit), n)
+
+def random_n_up_to_limit(n, range_limit, rng=random):
+    return rng.sample(range(range_limit), n)
 
 
 def split_list(list_to_split, first_chunk_size):
@@ -70,21 +242,80 @@ def chunk_list(list_to_chunk, chunk_size):
         yield list_to_chunk[i:i + chunk_size]
 
 
+def split_list_evenly(list_to_split, num_parts):
+    """Splits a list into num_parts contiguous parts whose sizes differ by at most one"""
+    (part_size, remainder) = divmod(len(list_to_split), num_parts)
+    parts = []
+    start_index = 0
+    for part_index in range(num_parts):
+        end_index = start_index + part_size + (1 if part_index < remainder else 0)
+        parts.append(list_to_split[start_index:end_index])
+        start_index = end_index
+    return parts
+
+
+def balanced_part_sizes(existing_sizes, item_count):
+    """
+    Calculates how many of item_count new items to add to each of a set of parts so the resulting part
+    sizes are as even as possible. Leftover items go to the smallest parts, lowest index first.
+    """
+    # Find the highest level that every part can be filled up to without running out of items
+    (low, high) = (min(existing_sizes), max(existing_sizes) + item_count)
+    while low < high:
+        level = (low + high + 1) // 2
+        if sum(max(0, level - size) for size in existing_sizes) <= item_count:
+            low = level
+        else:
+            high = level - 1
+    part_sizes = [max(0, low - size) for size in existing_sizes]
+    remainder = item_count - sum(part_sizes)
+    for part_index, size in enumerate(existing_sizes):
+        if remainder == 0:
+            break
+        if size <= low:
+            part_sizes[part_index] += 1
+            remainder -= 1
+    return part_sizes
+
+
+def split_list_by_sizes(list_to_split, part_sizes):
+    """Splits a list into contiguous parts with the given sizes"""
+    parts = []
+    start_index = 0
+    for part_size in part_sizes:
+        parts.append(list_to_split[start_index:start_index + part_size])
+        start_index += part_size
+    return parts
+
+
+def chunk_iterable(iterable, chunk_size):
+    """Like chunk_list, but works for any iterable (including generators)"""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, chunk_size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, chunk_size))
+
+
 def list_section(list_to_section, start_index, num_items):
     return list_to_section[start_index:start_index+num_items]
 
 
-def get_random_range_from_iterable(iterable, range_len):
-    start_index = randint(0, len(iterable) - range_len)
+def get_random_range_from_iterable(iterable, range_len, rng=random):
+    start_index = rng.randint(0, len(iterable) - range_len)
     return start_index, start_index + range_len
 
 
-def case_insensitive_lookup(d, key_to_find):
-    try:
-        key = next(k for k in d.keys() if key_to_find.lower() == k.lower())
-        return d[key]
-    except:
-        return None
+def normalize_lookup_key(key):
+    """Casefolds a string, strips accents and collapses whitespace (eg: ' Castilla y León' -> 'castilla y leon')"""
+    decomposed = unicodedata.normalize('NFKD', key)
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(stripped.casefold().split())
+
+
+def build_normalized_lookup(d):
+    """Creates a copy of a dict with keys normalized via normalize_lookup_key"""
+    return {normalize_lookup_key(key): value for key, value in d.items()}
 
 
 def filter_dict_keys(orig_dict, keys_to_keep):